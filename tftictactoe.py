@@ -7,11 +7,13 @@ Currently, there is only one model trained for a 4x4 size but there are plans
 to expand this number. It relies on tensorflow model files provided in the
 project.
 
+Tensorflow and NumPy are only imported once a model is loaded or evaluated,
+so the menus start without paying for them.
+
 Author: Jacob Dentes
 Date: 13 September 2021
 """
 import tictactoe
-import tensorflow as tf
 import time
 
 MIN_SIZE = 4
@@ -20,6 +22,299 @@ MAX_SIZE = 5
 models = {4: 'tf_ttt_model', 5: 'tf_ttt_model_5'}
 MODEL = None
 
+# Preallocated model input arrays, one per number of squares
+_inputs = {}
+
+# The tensorflow module, set by tensorflow() the first time it is needed
+_tf = None
+
+def tensorflow():
+    """Returns the tensorflow module, importing it the first time."""
+    global _tf
+    if _tf is None:
+        import tensorflow
+        _tf = tensorflow
+    return _tf
+
+class ModelRegistry():
+    """
+    A registry of models keyed by board size and version.
+
+    Models are loaded the first time they are asked for and kept in a bounded
+    least recently used cache, so later games on the same size reuse the
+    loaded model. Each model is warmed up with one single and one batched
+    inference right after loading, so the first move of a game does not pay
+    for tensorflow setting up the model.
+
+    Attribute paths: The path of each registered model
+    Invariant: paths is a dict mapping (size, version) tuples to str, paths
+    are relative to this module's directory unless absolute
+
+    Attribute capacity: The largest number of models kept loaded at once
+    Invariant: capacity is an int and capacity > 0
+
+    Attribute backend: How models are loaded
+    Invariant: backend is 'tensorflow' for saved model directories or 'numpy'
+    for the .npz exports of tttnumpy next to them
+
+    Attribute loaded: The loaded models, least recently used first
+    Invariant: loaded is an OrderedDict mapping (size, version) tuples to models
+    with len <= capacity
+
+    Attribute metrics: Load and warm up timings of each model, in seconds
+    Invariant: metrics is a dict mapping (size, version) tuples to dicts with
+    keys 'load_time' and 'first_inference_time'
+    """
+    def __init__(self, paths: dict = None, capacity: int = 2,
+                 backend: str = 'tensorflow'):
+        """
+        Creates a registry of the given models without loading any of them.
+
+        Parameter paths: The path of each model, or None for no models.
+        Precondition: paths is a dict mapping (size, version) tuples to str or
+        None
+
+        Parameter capacity: The largest number of models kept loaded at once.
+        Precondition: capacity is an int and capacity > 0
+
+        Parameter backend: How models are loaded.
+        Precondition: backend is 'tensorflow' or 'numpy'
+        """
+        from collections import OrderedDict
+        self.paths = dict(paths or {})
+        self.capacity = capacity
+        self.backend = backend
+        self.loaded = OrderedDict()
+        self.metrics = {}
+
+    def register(self, size: int, path: str, version: int = 1):
+        """
+        Adds a model to the registry without loading it.
+
+        Parameter size: The width and height of the boards the model scores.
+        Precondition: size is an int and size > 0
+
+        Parameter path: The path of the model.
+        Precondition: path is a str
+
+        Parameter version: The version of the model.
+        Precondition: version is an int
+        """
+        self.paths[(size, version)] = path
+        self.loaded.pop((size, version), None)
+
+    def get(self, size: int, version: int = None):
+        """
+        Returns the model for a board size, loading it if needed.
+
+        Parameter size: The width and height of the board.
+        Precondition: size is an int with a registered model
+
+        Parameter version: The version of the model, or None for the newest.
+        Precondition: version is an int with a registered model or None
+        """
+        if version is None:
+            version = max(v for s, v in self.paths if s == size)
+        key = (size, version)
+        if key in self.loaded:
+            self.loaded.move_to_end(key)
+            return self.loaded[key]
+        t1 = time.time()
+        model = self.load(self.paths[key])
+        t2 = time.time()
+        self.warm_up(model, size)
+        self.metrics[key] = {'load_time': t2 - t1,
+                             'first_inference_time': time.time() - t2}
+        self.loaded[key] = model
+        while len(self.loaded) > self.capacity:
+            self.loaded.popitem(last=False)
+        return model
+
+    def load(self, path: str):
+        """
+        Returns the model stored at path, loaded with the registry's backend.
+
+        Parameter path: The path of the model.
+        Precondition: path is a str
+        """
+        import os
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+        if self.backend == 'numpy':
+            import tttnumpy
+            return tttnumpy.NumpyModel(path + '.npz')
+        return tensorflow().keras.models.load_model(path)
+
+    def warm_up(self, model, size: int):
+        """
+        Runs a single and a batched inference on empty boards.
+
+        Parameter model: The model to warm up.
+        Precondition: model is a model for boards of size
+
+        Parameter size: The width and height of the board.
+        Precondition: size is an int and size > 0
+        """
+        input = input_buffer(size * size)
+        input[:] = 0
+        model(input[:1], training=False)
+        model(input, training=False)
+
+    def model_name(self, size: int, version: int = None) -> str:
+        """
+        Returns a str naming the model for a board size, for EvalCache files.
+
+        Parameter size: The width and height of the board.
+        Precondition: size is an int with a registered model
+
+        Parameter version: The version of the model, or None for the newest.
+        Precondition: version is an int with a registered model or None
+        """
+        if version is None:
+            version = max(v for s, v in self.paths if s == size)
+        return f'{size} {self.paths[(size, version)]} {version}'
+
+registry = ModelRegistry({(size, 1): path for size, path in models.items()})
+
+class EvalCache():
+    """
+    A bounded cache of model evaluations keyed by canonical position.
+
+    Positions are keyed by Board.canonical_key, so a value computed for one
+    board is reused for all of its rotations and reflections. The cache is a
+    set associative table: a key can only live in the WAYS slots of the set
+    key % sets, and when a set is full the CLOCK policy evicts a slot that
+    has not been read since the set's hand last passed it.
+
+    The slots are a NumPy structured array. When a path is given the array
+    is a memory mapped file, so the cache survives restarts and warm starts
+    skip positions evaluated by earlier runs. The file starts with a header
+    of HEADER_BYTES naming the number of slots and the model, and a file
+    whose header does not match is started over, so values are never read
+    back for a different model or board size.
+
+    Attribute slots: The key, value, and reference bit of each slot
+    Invariant: slots is a NumPy array of capacity records with fields 'key'
+    (uint64, 0 when empty), 'value' (float32), and 'ref' (uint8)
+
+    Attribute hands: The CLOCK hand of each set
+    Invariant: hands is a list of int, each 0 <= hand < WAYS
+
+    Attribute hits: The number of lookups that found a value
+    Invariant: hits is an int and hits >= 0
+
+    Attribute misses: The number of lookups that found nothing
+    Invariant: misses is an int and misses >= 0
+    """
+    WAYS = 4
+    HEADER_BYTES = 256
+    MAGIC = b'EVALCACHE1'
+
+    def __init__(self, capacity: int = 2 ** 20, path: str = None,
+                 model: str = ''):
+        """
+        Creates a cache with room for about capacity evaluations.
+
+        Parameter capacity: The number of slots, rounded up to a whole set.
+        Precondition: capacity is an int and capacity > 0
+
+        Parameter path: The file to memory map, or None to keep the cache
+        in memory only. An existing file is reused when its header has the
+        same number of slots and model.
+        Precondition: path is a str or None
+
+        Parameter model: The model whose values are cached, such as the board
+        size, path, and version from model_name.
+        Precondition: model is a str of at most 200 bytes in UTF-8
+        """
+        import numpy as np
+        import os
+        dtype = np.dtype([('key', '<u8'), ('value', '<f4'), ('ref', 'u1')])
+        sets = -(-capacity // self.WAYS)
+        shape = (sets * self.WAYS,)
+        if path is None:
+            self.slots = np.zeros(shape, dtype=dtype)
+        else:
+            header = b'%s %d %s' % (self.MAGIC, shape[0], model.encode())
+            header = header.ljust(self.HEADER_BYTES, b'\0')
+            size = self.HEADER_BYTES + shape[0] * dtype.itemsize
+            reuse = os.path.exists(path) and os.path.getsize(path) == size
+            if reuse:
+                with open(path, 'rb') as f:
+                    reuse = f.read(self.HEADER_BYTES) == header
+            if not reuse:
+                with open(path, 'wb') as f:
+                    f.write(header)
+                    f.truncate(size)
+            self.slots = np.memmap(path, dtype=dtype, shape=shape, mode='r+',
+                                   offset=self.HEADER_BYTES)
+        self.sets = sets
+        self.hands = [0] * sets
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        """Returns the number of filled slots."""
+        return int((self.slots['key'] != 0).sum())
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of lookups that found a value, 0 before any lookup."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key: int):
+        """
+        Returns the value stored for key, or None if it is not cached.
+
+        Parameter key: The canonical key of the position.
+        Precondition: key is an int and 0 <= key < 2 ** 64
+        """
+        key = key or 1
+        base = (key % self.sets) * self.WAYS
+        slots = self.slots
+        for index in range(base, base + self.WAYS):
+            if int(slots['key'][index]) == key:
+                slots['ref'][index] = 1
+                self.hits += 1
+                return float(slots['value'][index])
+        self.misses += 1
+        return None
+
+    def put(self, key: int, value: float):
+        """
+        Stores the value of key, evicting another entry if the set is full.
+
+        Parameter key: The canonical key of the position.
+        Precondition: key is an int and 0 <= key < 2 ** 64
+
+        Parameter value: The value of the position.
+        Precondition: value is a float and -1 < value < 1
+        """
+        key = key or 1
+        set_index = key % self.sets
+        base = set_index * self.WAYS
+        slots = self.slots
+        keys = [int(k) for k in slots['key'][base:base + self.WAYS]]
+        for way in range(self.WAYS):
+            if keys[way] == key or keys[way] == 0:
+                break
+        else:
+            # Every way is taken, so the CLOCK hand picks one to evict
+            way = self.hands[set_index]
+            while slots['ref'][base + way]:
+                slots['ref'][base + way] = 0
+                way = (way + 1) % self.WAYS
+            self.hands[set_index] = (way + 1) % self.WAYS
+        slots[base + way] = (key, value, 1)
+
+    def flush(self):
+        """Writes a memory mapped cache to disk."""
+        if hasattr(self.slots, 'flush'):
+            self.slots.flush()
+
+# The evaluation cache of each board size used by play_loop
+caches = {}
+
 def clamp(x, min, max):
     """
     Returns x clamped between min and max.
@@ -39,20 +334,91 @@ def clamp(x, min, max):
     """
     return min * (x < min) + max * (x > max) + x * (min <= x <= max)
 
+def input_buffer(squares: int):
+    """
+    Returns the preallocated model input array for boards of squares cells.
+
+    The array has one row for every possible child of a board and squares + 1
+    columns, the flattened board followed by the turn. It is reused between
+    calls, so callers must copy anything they want to keep.
+
+    Parameter squares: The number of cells on the board
+    Precondition: squares is an int and squares > 0
+    """
+    import numpy as np
+    if squares not in _inputs:
+        _inputs[squares] = np.zeros((squares, squares + 1), dtype=np.float32)
+    return _inputs[squares]
+
 def eval(self) -> float:
     """
     Returns a float representing a board's value.
 
     The function feeds the input into a tensorflow model to generate the
-    value. -1 < value < 1.
+    value. -1 < value < 1. When the board has a CACHE attribute that is an
+    EvalCache, values are looked up in it before calling the model.
     """
-    input = self.flatten()
-    input.append(1 if self.x_turn else -1)
-    input = [input]
+    import numpy as np
+    cache = getattr(self, 'CACHE', None)
+    if cache is not None:
+        key = self.canonical_key()[0]
+        value = cache.get(key)
+        if value is not None:
+            return value
+    input = input_buffer(self.size)[:1]
+    input[0, :self.size] = self.flatten()
+    input[0, self.size] = 1 if self.x_turn else -1
 
-    return clamp(self.MODEL.predict(input)[0], -0.999, 0.999)
+    value = np.asarray(self.MODEL(input, training=False))[0][0]
+    value = clamp(float(value), -0.999, 0.999)
+    if cache is not None:
+        cache.put(key, value)
+    return value
 
-def play_0p(model, size=4, max_think=30):
+def eval_children(self, moves: list) -> list:
+    """
+    Returns a list of floats representing the values of a board's children.
+
+    Builds the inputs for the board after each of moves in the preallocated
+    input array and scores all of them with a single forward pass of the
+    tensorflow model. Each value v satisfies -1 < v < 1. When the board has a
+    CACHE attribute that is an EvalCache, only the children missing from it
+    are sent to the model.
+
+    Parameter moves: The moves to score.
+    Precondition: moves is a list of legal moves of the board
+    """
+    import numpy as np
+    cache = getattr(self, 'CACHE', None)
+    scores = [None] * len(moves)
+    if cache is not None:
+        keys = []
+        for move in moves:
+            self.move(move)
+            keys.append(self.canonical_key()[0])
+            self.unmove()
+        scores = [cache.get(key) for key in keys]
+        pending = [move for move, score in zip(moves, scores) if score is None]
+        if not pending:
+            return scores
+    else:
+        pending = moves
+    count = len(pending)
+    input = input_buffer(self.size)[:count]
+    input[:, :self.size] = self.flatten()
+    input[:, self.size] = -1 if self.x_turn else 1
+    input[np.arange(count), pending] = 1 if self.x_turn else -1
+
+    values = np.asarray(self.MODEL(input, training=False))[:, 0]
+    values = iter(np.clip(values, -0.999, 0.999).tolist())
+    for index, score in enumerate(scores):
+        if score is None:
+            scores[index] = next(values)
+            if cache is not None:
+                cache.put(keys[index], scores[index])
+    return scores
+
+def play_0p(model, size=4, max_think=30, cache=None):
     """
     Start an ai vs ai game on a board of the designated size with the designated
     ai think time.
@@ -68,18 +434,24 @@ def play_0p(model, size=4, max_think=30):
 
     Parameter max_think: The maximum amount of time the ai can spend per move.
     Precondition: max_think is an int or float and max_think > 0.
+
+    Parameter cache: A cache of model evaluations, or None for no cache.
+    Precondition: cache is an EvalCache or None
     """
     size = int(clamp(size, MIN_SIZE, MAX_SIZE))
     board = tictactoe.new_board(size)
     board.MODEL = model
+    board.CACHE = cache
     board.change_eval(eval)
+    board.change_batch_eval(eval_children)
+    engine = tictactoe.Engine()
 
     while not board.check_game_end()[0]:
         print(board)
         turn = 'X' if board.x_turn else 'O'
         print(f'AI for {turn} thinking')
         t1 = time.time()
-        choice = board.ai(max_think)
+        choice = board.ai(max_think, engine=engine)
         print(f'AI chose {choice} in {time.time() - t1} seconds.')
         board.move(choice)
 
@@ -91,7 +463,7 @@ def play_0p(model, size=4, max_think=30):
         winner = 'X' if end[1] == 1 else 'O'
         print(f'{winner} wins!')
 
-def play_1p(model, size=4, max_think=30):
+def play_1p(model, size=4, max_think=30, cache=None):
     """
     Start a player vs ai game on a board of the designated size with the designated
     ai think time.
@@ -107,11 +479,17 @@ def play_1p(model, size=4, max_think=30):
 
     Parameter max_think: The maximum amount of time the ai can spend per move.
     Precondition: max_think is an int or float and max_think > 0.
+
+    Parameter cache: A cache of model evaluations, or None for no cache.
+    Precondition: cache is an EvalCache or None
     """
     size = int(clamp(size, MIN_SIZE, MAX_SIZE))
     board = tictactoe.new_board(size)
     board.MODEL = model
+    board.CACHE = cache
     board.change_eval(eval)
+    board.change_batch_eval(eval_children)
+    engine = tictactoe.Engine()
 
     player_turn = True
 
@@ -150,7 +528,7 @@ def play_1p(model, size=4, max_think=30):
         else:
             print('AI thinking...')
             t1 = time.time()
-            choice = board.ai(max_think)
+            choice = board.ai(max_think, engine=engine)
             print(f'AI chose {choice} in {time.time() - t1} seconds.')
             board.move(choice)
             player_turn = not player_turn
@@ -190,11 +568,15 @@ def play_loop(players):
         if not playing:
             break
         size = int(clamp(int(inp), MIN_SIZE, MAX_SIZE))
-        MODEL = models[size]
+        MODEL = registry.get(size)
+        if size not in caches:
+            caches[size] = EvalCache()
         if players == 0:
-            play_0p(MODEL, size = int(inp), max_think = int(think_input))
+            play_0p(MODEL, size = int(inp), max_think = int(think_input),
+                    cache = caches[size])
         else:
-            play_1p(MODEL, size = int(inp), max_think = int(think_input))
+            play_1p(MODEL, size = int(inp), max_think = int(think_input),
+                    cache = caches[size])
 
 def main():
     while True:
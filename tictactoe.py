@@ -11,6 +11,354 @@ tic tac toe games.
 Author: Jacob Dentes
 Date: 14 September 2021
 """
+from bisect import insort
+from functools import lru_cache
+
+@lru_cache(maxsize=None)
+def line_masks(size: int) -> tuple:
+    """
+    Returns a tuple of bitmasks, one for every winning line on the board.
+
+    Bit i of a mask is set when cell i lies on the line, where cells are
+    numbered left to right and top down. The rows come first, then the columns,
+    then the diagonal from the top left and the diagonal from the top right.
+    The table is built once per board size and cached.
+
+    Parameter size: The width and height of the board
+    Precondition: size is an int and size > 0
+    """
+    rows = [sum(1 << (r * size + c) for c in range(size)) for r in range(size)]
+    columns = [sum(1 << (r * size + c) for r in range(size))
+               for c in range(size)]
+    diag = sum(1 << (i * size + i) for i in range(size))
+    anti_diag = sum(1 << (i * size + size - 1 - i) for i in range(size))
+    return tuple(rows + columns + [diag, anti_diag])
+
+@lru_cache(maxsize=None)
+def cell_lines(size: int) -> tuple:
+    """
+    Returns a tuple holding, for every cell, the lines that pass through it.
+
+    Each item is a tuple of indices into line_masks(size). A cell lies on one
+    row and one column and on zero, one, or two diagonals.
+
+    Parameter size: The width and height of the board
+    Precondition: size is an int and size > 0
+    """
+    masks = line_masks(size)
+    return tuple(tuple(line for line, mask in enumerate(masks)
+                       if (mask >> cell) & 1)
+                 for cell in range(size * size))
+
+@lru_cache(maxsize=None)
+def zobrist_table(size: int) -> tuple:
+    """
+    Returns the random keys used to build a board's Zobrist hash.
+
+    Returns a tuple (x_keys, o_keys, turn_key). x_keys and o_keys hold one
+    random 64 bit int per cell and turn_key is xored in whenever the turn
+    changes. The generator is seeded with size, so every process builds the
+    same table and keys can be shared between processes.
+
+    Parameter size: The width and height of the board
+    Precondition: size is an int and size > 0
+    """
+    import random
+    rng = random.Random(size)
+    x_keys = tuple(rng.getrandbits(64) for _ in range(size * size))
+    o_keys = tuple(rng.getrandbits(64) for _ in range(size * size))
+    return x_keys, o_keys, rng.getrandbits(64)
+
+@lru_cache(maxsize=None)
+def symmetry_tables(size: int) -> tuple:
+    """
+    Returns permutation tables for the 8 rotations and reflections of a board.
+
+    Returns a tuple (perms, inverses). perms is a tuple of 8 tuples where
+    perms[s][i] is the cell that cell i is moved to by symmetry s, and
+    inverses[s] undoes perms[s]. Symmetry 0 is the identity, 1 to 3 are
+    clockwise rotations by 90, 180, and 270 degrees, and 4 to 7 are the
+    reflections across the vertical axis, the horizontal axis, the diagonal
+    from the top left, and the diagonal from the top right.
+
+    Parameter size: The width and height of the board
+    Precondition: size is an int and size > 0
+    """
+    n = size - 1
+    transforms = (
+        lambda r, c: (r, c),
+        lambda r, c: (c, n - r),
+        lambda r, c: (n - r, n - c),
+        lambda r, c: (n - c, r),
+        lambda r, c: (r, n - c),
+        lambda r, c: (n - r, c),
+        lambda r, c: (c, r),
+        lambda r, c: (n - c, n - r),
+    )
+    perms = []
+    inverses = []
+    for transform in transforms:
+        perm = [0] * (size * size)
+        inverse = [0] * (size * size)
+        for cell in range(size * size):
+            r, c = transform(cell // size, cell % size)
+            perm[cell] = r * size + c
+            inverse[r * size + c] = cell
+        perms.append(tuple(perm))
+        inverses.append(tuple(inverse))
+    return tuple(perms), tuple(inverses)
+
+@lru_cache(maxsize=None)
+def symmetric_zobrist_table(size: int) -> tuple:
+    """
+    Returns Zobrist keys for all 8 symmetries packed into single ints.
+
+    Returns a tuple (x_keys, o_keys, turn_key) shaped like zobrist_table(size).
+    Each key is a 512 bit int made of 8 lanes of 64 bits, and lane s holds the
+    key the cell would have after symmetry s from symmetry_tables. Xoring a
+    packed key updates the hash of all 8 symmetric boards at once.
+
+    Parameter size: The width and height of the board
+    Precondition: size is an int and size > 0
+    """
+    x_keys, o_keys, turn_key = zobrist_table(size)
+    perms = symmetry_tables(size)[0]
+    def pack(keys, cell):
+        return sum(keys[perm[cell]] << (64 * s) for s, perm in enumerate(perms))
+    packed_x = tuple(pack(x_keys, cell) for cell in range(size * size))
+    packed_o = tuple(pack(o_keys, cell) for cell in range(size * size))
+    packed_turn = sum(turn_key << (64 * s) for s in range(8))
+    return packed_x, packed_o, packed_turn
+
+def transform_flat(flat: list, sym: int, size: int) -> list:
+    """
+    Returns a flattened board moved by one of the 8 board symmetries.
+
+    Items after the first size * size, such as an appended turn, are kept
+    at the end unchanged.
+
+    Parameter flat: A board as returned by Board.flatten.
+    Precondition: flat is a list with len >= size * size
+
+    Parameter sym: The symmetry to apply, as numbered in symmetry_tables.
+    Precondition: sym is an int and 0 <= sym < 8
+
+    Parameter size: The width and height of the board
+    Precondition: size is an int and size > 0
+    """
+    perm = symmetry_tables(size)[1][sym]
+    return [flat[perm[cell]] for cell in range(size * size)] + list(
+                flat[size * size:])
+
+def canonical_form(flat: list, size: int) -> list:
+    """
+    Returns the canonical version of a flattened board.
+
+    The canonical version is the smallest of the 8 symmetric versions of the
+    board, so boards that are rotations or reflections of each other share
+    one canonical form. Items after the first size * size are kept at the end.
+
+    Parameter flat: A board as returned by Board.flatten.
+    Precondition: flat is a list with len >= size * size
+
+    Parameter size: The width and height of the board
+    Precondition: size is an int and size > 0
+    """
+    return min(transform_flat(flat, sym, size) for sym in range(8))
+
+# Bound flags for transposition table entries
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# The number of nodes searched between checks of the clock
+POLL_NODES = 1024
+
+class SearchAborted(Exception):
+    """Raised inside a search when its deadline or node budget is reached."""
+    pass
+
+class TranspositionTable():
+    """
+    A fixed size table of search results keyed by Zobrist hash.
+
+    Each slot holds None or a tuple (key, depth, flag, value, move, generation).
+    flag is EXACT, LOWER, or UPPER depending on whether value is the exact
+    minimax value or a lower or upper bound on it. move is the best move found
+    or None. A slot is chosen by key % capacity. A new entry replaces the old
+    one when the old entry is for the same key, was stored by an earlier
+    search, or was searched to the same depth or less.
+
+    When canonical is True the search keys the table on Board.canonical_key,
+    so rotations and reflections of a position share one entry, and stored
+    moves are in the frame of the canonical board.
+
+    Attribute canonical: True when the table is keyed on canonical positions
+    Invariant: canonical is a bool
+
+    Attribute capacity: The number of slots in the table
+    Invariant: capacity is an int and capacity > 0
+
+    Attribute slots: The list of stored entries
+    Invariant: slots is a list with len capacity
+
+    Attribute generation: The number of searches started with this table
+    Invariant: generation is an int and generation >= 0
+    """
+    # Rough number of bytes used by one stored entry and its slot
+    ENTRY_BYTES = 168
+
+    def __init__(self, megabytes: float = 16, canonical: bool = True):
+        """
+        Create an empty table that uses about megabytes of memory when full.
+
+        Parameter megabytes: The memory cap for the table in megabytes.
+        Precondition: megabytes is an int or float and megabytes > 0
+
+        Parameter canonical: Whether to key the table on canonical positions.
+        Precondition: canonical is a bool
+        """
+        self.canonical = canonical
+        self.capacity = max(1, int(megabytes * 2 ** 20) // self.ENTRY_BYTES)
+        self.slots = [None] * self.capacity
+        self.generation = 0
+
+    def __len__(self) -> int:
+        """Returns the number of filled slots."""
+        return self.capacity - self.slots.count(None)
+
+    def probe(self, key: int):
+        """
+        Returns the entry stored for key or None if there is no entry.
+
+        Parameter key: The Zobrist key of the position.
+        Precondition: key is an int
+        """
+        entry = self.slots[key % self.capacity]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key: int, depth: int, flag: int, value, move):
+        """
+        Stores a search result for key using the depth-preferred policy.
+
+        Parameter key: The Zobrist key of the position.
+        Precondition: key is an int
+
+        Parameter depth: The remaining depth the position was searched to.
+        Precondition: depth is an int
+
+        Parameter flag: Whether value is exact or a bound.
+        Precondition: flag is EXACT, LOWER, or UPPER
+
+        Parameter value: The value found by the search.
+        Precondition: value is an int or float and -1 <= value <= 1
+
+        Parameter move: The best move found, or None.
+        Precondition: move is an int or None
+        """
+        index = key % self.capacity
+        old = self.slots[index]
+        if (old is None or old[0] == key or old[5] != self.generation
+                or depth >= old[1]):
+            self.slots[index] = (key, depth, flag, value, move,
+                                 self.generation)
+
+    def new_search(self):
+        """Marks every stored entry as belonging to an earlier search."""
+        self.generation += 1
+
+    def clear(self):
+        """Removes every entry from the table."""
+        self.slots = [None] * self.capacity
+        self.generation = 0
+
+class SearchStats():
+    """
+    A record of what a search did, filled in by Board.ai when passed one.
+
+    Totals cover the whole search. After every finished iteration of
+    iterative deepening a dict is added to iterations, and passed to
+    callback if there is one, with the keys:
+        'depth': the depth of the iteration
+        'move': the best move found
+        'value': the value of the best move, from X's point of view
+        'nodes': the positions visited during the iteration
+        'leaf_evals': the calls to the evaluation function in the iteration
+        'elapsed': the seconds the iteration took
+        'branching': the effective branching factor, the nodes of the
+            iteration divided by the nodes of the one before, or None for
+            the first iteration of each search
+        'pv': the principal variation, a list of moves from the root
+
+    Attribute iterations: The finished iterations, in order
+    Invariant: iterations is a list of dicts
+
+    Attribute nodes: The positions visited by the search
+    Invariant: nodes is an int and nodes >= 0
+
+    Attribute leaf_evals: The boards scored by the evaluation function
+    Invariant: leaf_evals is an int and leaf_evals >= 0
+
+    Attribute probes: The transposition table lookups
+    Invariant: probes is an int and probes >= 0
+
+    Attribute hits: The transposition table lookups that found an entry
+    Invariant: hits is an int and 0 <= hits <= probes
+
+    Attribute cutoffs: The beta cutoffs at each ply below the root, starting
+    with the positions one move from the root. Those are searched with a full
+    window, so they only cut off at a forced win.
+    Invariant: cutoffs is a list of int
+
+    Attribute elapsed: The seconds the whole search took
+    Invariant: elapsed is a float and elapsed >= 0
+
+    Attribute callback: Called with each iteration dict, or None
+    Invariant: callback is a function taking a dict, or None
+    """
+    def __init__(self, callback = None):
+        """
+        Creates an empty record.
+
+        Parameter callback: A function called after every finished iteration.
+        Precondition: callback is a function taking a dict, or None
+        """
+        self.callback = callback
+        self.iterations = []
+        self.nodes = 0
+        self.leaf_evals = 0
+        self.probes = 0
+        self.hits = 0
+        self.cutoffs = []
+        self.elapsed = 0.0
+
+    def __str__(self) -> str:
+        """Returns a table of the iterations followed by the totals."""
+        lines = []
+        for info in self.iterations:
+            branching = info['branching']
+            branching = '-' if branching is None else f'{branching:.2f}'
+            lines.append(f'depth {info["depth"]}: move {info["move"]} ' +
+                         f'value {info["value"]:.3f} nodes {info["nodes"]} ' +
+                         f'evals {info["leaf_evals"]} ' +
+                         f'time {info["elapsed"]:.3f}s ' +
+                         f'branching {branching} pv {info["pv"]}')
+        lines.append(f'{self.nodes} nodes, {self.leaf_evals} evals, ' +
+                     f'{self.hit_rate():.0%} table hits, ' +
+                     f'cutoffs by ply {self.cutoffs}, {self.elapsed:.3f}s')
+        return '\n'.join(lines)
+
+    @property
+    def depth(self) -> int:
+        """The depth of the last finished iteration, 0 if none finished."""
+        return self.iterations[-1]['depth'] if self.iterations else 0
+
+    def hit_rate(self) -> float:
+        """Returns the fraction of table lookups that found an entry."""
+        return self.hits / self.probes if self.probes else 0.0
+
 class Board():
     """
     A class representing a tic tac toe board.
@@ -24,12 +372,35 @@ class Board():
     Attribute size: The total number of spaces on the board
     Invariant: size is an int and size == width * height
 
-    Attribute board_list: A list of lists holding the contents of the board rows
-    Invariant: board_list is a list with len height holding lists with len width
+    Attribute x_bits: A bitmask of the cells played by X, bit i is cell i
+    Invariant: x_bits is an int and 0 <= x_bits < 2 ** size
+
+    Attribute o_bits: A bitmask of the cells played by O, bit i is cell i
+    Invariant: o_bits is an int, 0 <= o_bits < 2 ** size and
+    x_bits & o_bits == 0
 
     Attribute x_turn: True when it is currently the X player's turn
     Invariant: x_turn is a bool
 
+    Attribute line_x: The number of X cells on each line of line_masks(width)
+    Invariant: line_x is a list of int with len 2 * width + 2
+
+    Attribute line_o: The number of O cells on each line of line_masks(width)
+    Invariant: line_o is a list of int with len 2 * width + 2
+
+    Attribute x_wins: The number of lines completely filled by X
+    Invariant: x_wins is an int and x_wins == line_x.count(width)
+
+    Attribute o_wins: The number of lines completely filled by O
+    Invariant: o_wins is an int and o_wins == line_o.count(width)
+
+    Attribute key: The Zobrist hash of the cells and the current turn
+    Invariant: key is an int built from zobrist_table(width)
+
+    Attribute sym_keys: The Zobrist hashes of all 8 symmetric boards
+    Invariant: sym_keys is an int built from symmetric_zobrist_table(width)
+    and sym_keys & (2 ** 64 - 1) == key
+
     Attribute moves: Holds a list of moves that have been played so far
     Invariant: moves is a list of int with len <= size
 
@@ -52,11 +423,16 @@ class Board():
             self.width = size
             self.height = size
             self.size = size * size
-            self.board_list = []
+            self.x_bits = 0
+            self.o_bits = 0
+            self.line_x = [0] * (2 * size + 2)
+            self.line_o = [0] * (2 * size + 2)
+            self.x_wins = 0
+            self.o_wins = 0
             self.x_turn = True
+            self.key = 0
+            self.sym_keys = 0
             self.moves = []
-            for i in range(self.height):
-                self.board_list.append([None for _ in range(self.width)])
             self.legal_moves = self.generate_legal_moves()
 
     def __str__(self) -> str:
@@ -92,13 +468,8 @@ class Board():
                 return_string += '\n' + ('-' * (7 * self.width)) + '\n'
         return return_string + '\n'
     def __hash__(self):
-        """Returns a hash based on the flattened board and current turn."""
-        x = self.flatten()
-        if self.x_turn:
-            x.append(1)
-        else:
-            x.append(-1)
-        return hash(tuple(x))
+        """Returns a hash based on the Zobrist key of the board."""
+        return hash(self.key)
     def __gt__(self, other) -> bool:
         """
         Returns a bool for whether or not a board is greater than another.
@@ -120,22 +491,44 @@ class Board():
         Two boards are the same when they have the same size, the same letters
         in the same places, and have the same player as the current turn.
         """
-        self_board = self.flatten()
-        self_board.append(1 if self.x_turn else -1)
-        other_board = other.flatten()
-        other_board.append(1 if other.x_turn else -1)
-        return self_board == other_board
+        return (self.size == other.size and self.x_bits == other.x_bits
+                and self.o_bits == other.o_bits
+                and self.x_turn == other.x_turn)
+
+    @property
+    def board_list(self) -> list:
+        """
+        A list of lists holding the contents of the board rows.
+
+        Each cell is 'X', 'O', or None. The list is rebuilt from x_bits and
+        o_bits on every access, so changing it does not change the board.
+
+        Invariant: board_list is a list with len height holding lists with
+        len width
+        """
+        return_list = []
+        index = 0
+        for _ in range(self.height):
+            row = []
+            for _ in range(self.width):
+                if (self.x_bits >> index) & 1:
+                    row.append('X')
+                elif (self.o_bits >> index) & 1:
+                    row.append('O')
+                else:
+                    row.append(None)
+                index += 1
+            return_list.append(row)
+        return return_list
 
     def generate_legal_moves(self) -> list:
         """Returns a list of all legal moves for the current board."""
-        board = self.board_list
-        index = 0
+        empty = ((1 << self.size) - 1) & ~(self.x_bits | self.o_bits)
         return_list = []
-        for row in board:
-            for column in row:
-                if column is None:
-                    return_list.append(index)
-                index += 1
+        while empty:
+            low = empty & -empty
+            return_list.append(low.bit_length() - 1)
+            empty ^= low
         return return_list
     @property
     def shuffled_legal_moves(self) -> list:
@@ -150,14 +543,51 @@ class Board():
         shuffle(x)
         return x
 
+    def canonical_key(self) -> tuple:
+        """
+        Returns a tuple of the canonical Zobrist key and its symmetry.
+
+        The canonical key is the smallest key of the 8 rotations and
+        reflections of the board, so symmetric boards share it. The second
+        value is the symmetry from symmetry_tables that turns this board into
+        the canonical one.
+        """
+        keys = self.sym_keys
+        best = keys & 0xFFFFFFFFFFFFFFFF
+        best_sym = 0
+        for sym in range(1, 8):
+            keys >>= 64
+            lane = keys & 0xFFFFFFFFFFFFFFFF
+            if lane < best:
+                best = lane
+                best_sym = sym
+        return best, best_sym
+
+    def encode(self) -> bytes:
+        """
+        Returns a compact encoding of the board for sending between processes.
+
+        The first byte is the width, plus 128 when O played the first move,
+        and each following byte is a move, in the order the moves were played.
+        decode_board rebuilds the board.
+        """
+        o_first = self.x_turn != (len(self.moves) % 2 == 0)
+        return bytes([self.width | (128 if o_first else 0)] + self.moves)
+
     def create_copy(self):
         """Returns a copy of the board."""
-        from copy import copy, deepcopy
         x = new_board(self.width)
-        x.board_list = deepcopy(self.board_list)
-        x.x_turn = copy(self.x_turn)
-        x.moves = copy(self.moves)
-        x.legal_moves = copy(self.legal_moves)
+        x.x_bits = self.x_bits
+        x.o_bits = self.o_bits
+        x.line_x = self.line_x.copy()
+        x.line_o = self.line_o.copy()
+        x.x_wins = self.x_wins
+        x.o_wins = self.o_wins
+        x.x_turn = self.x_turn
+        x.key = self.key
+        x.sym_keys = self.sym_keys
+        x.moves = self.moves.copy()
+        x.legal_moves = self.legal_moves.copy()
         return x
     def flatten(self) -> list:
         """
@@ -168,18 +598,10 @@ class Board():
         for the given board. -1 represents 'O', 1 represents 'X', and 0
         represents an empty space.
         """
-        board = self.board_list
-        return_list = []
-        for row in board:
-            for column in row:
-                if column is None:
-                    column = 0
-                elif column == 'X':
-                    column = 1
-                elif column == 'O':
-                    column = -1
-                return_list.append(column)
-        return return_list
+        x_bits = self.x_bits
+        o_bits = self.o_bits
+        return [1 if (x_bits >> i) & 1 else -1 if (o_bits >> i) & 1 else 0
+                for i in range(self.size)]
 
     def check_game_end(self) -> tuple:
         """
@@ -188,46 +610,20 @@ class Board():
         Returns a tuple. The first value will be True if the game ended. The
         second value will be 0 for a draw or tie, 1 if X won, and -1 if O won.
         """
-        board = self.board_list
-        game_over = False
-        if len(self.generate_legal_moves()) <= 0:
-            game_over = True
-        # Checks every horizontal win condition
-        for horizontal_list in board:
-            if all([item == 'X' for item in horizontal_list]):
-                return (True, 1)
-            if all([item == 'O' for item in horizontal_list]):
-                return (True, -1)
-        # Checks every vertical win condition
-        for vertical_list in zip(*board):
-            if all([item == 'X' for item in vertical_list]):
-                return (True, 1)
-            if all([item == 'O' for item in vertical_list]):
-                return (True, -1)
-        # Checks the diagonal win condition from top left
-        diag_list = []
-        index = 0
-        while index < self.width and index < self.height:
-            diag_list.append(board[index][index])
-            index += 1
-        if all([item == 'X' for item in diag_list]):
-            return (True, 1)
-        if all([item == 'O' for item in diag_list]):
-            return (True, -1)
-        # Checks the diagonal win condition from top right
-        diag_list = []
-        index = self.width - 1
-        h_index = 0
-        while 0 <= index and index < self.width and h_index < self.height:
-            diag_list.append(board[h_index][index])
-            index -= 1
-            h_index += 1
-        if all([item == 'X' for item in diag_list]):
+        x_bits = self.x_bits
+        o_bits = self.o_bits
+        if self.x_wins and self.o_wins:
+            # Both players have a line, report whichever line comes first
+            for mask in line_masks(self.width):
+                if x_bits & mask == mask:
+                    return (True, 1)
+                if o_bits & mask == mask:
+                    return (True, -1)
+        if self.x_wins:
             return (True, 1)
-        if all([item == 'O' for item in diag_list]):
+        if self.o_wins:
             return (True, -1)
-
-        return (game_over, 0)
+        return ((x_bits | o_bits) == (1 << self.size) - 1, 0)
     def insert(self, item, target: int):
         """
         Inserts a string into the board at the specified target index.
@@ -238,19 +634,55 @@ class Board():
         Parameter target: The location to insert the item, 0 indexed.
         Precondition: target is an int and 0 <= target < board size.
         """
-        board = self.board_list
-        index = 0
-        for row, _ in enumerate(board):
-            for column, _ in enumerate(board[row]):
-                if index == target:
-                    board[row][column] = item
-                    return
-                index += 1
+        x_keys, o_keys, _ = zobrist_table(self.width)
+        sym_x_keys, sym_o_keys, _ = symmetric_zobrist_table(self.width)
+        lines = cell_lines(self.width)[target]
+        width = self.width
+        bit = 1 << target
+        if self.x_bits & bit:
+            self.key ^= x_keys[target]
+            self.sym_keys ^= sym_x_keys[target]
+            line_x = self.line_x
+            for line in lines:
+                if line_x[line] == width:
+                    self.x_wins -= 1
+                line_x[line] -= 1
+        elif self.o_bits & bit:
+            self.key ^= o_keys[target]
+            self.sym_keys ^= sym_o_keys[target]
+            line_o = self.line_o
+            for line in lines:
+                if line_o[line] == width:
+                    self.o_wins -= 1
+                line_o[line] -= 1
+        self.x_bits &= ~bit
+        self.o_bits &= ~bit
+        if item == 'X':
+            self.x_bits |= bit
+            self.key ^= x_keys[target]
+            self.sym_keys ^= sym_x_keys[target]
+            line_x = self.line_x
+            for line in lines:
+                line_x[line] += 1
+                if line_x[line] == width:
+                    self.x_wins += 1
+        elif item == 'O':
+            self.o_bits |= bit
+            self.key ^= o_keys[target]
+            self.sym_keys ^= sym_o_keys[target]
+            line_o = self.line_o
+            for line in lines:
+                line_o[line] += 1
+                if line_o[line] == width:
+                    self.o_wins += 1
     def unmove(self):
         """Undoes the previous move."""
-        self.insert(None, self.moves.pop())
-        self.legal_moves = self.generate_legal_moves()
+        target = self.moves.pop()
+        self.insert(None, target)
+        insort(self.legal_moves, target)
         self.x_turn = not self.x_turn
+        self.key ^= zobrist_table(self.width)[2]
+        self.sym_keys ^= symmetric_zobrist_table(self.width)[2]
     def move(self, input) -> bool:
         """
         Returns a bool if a given move is successful and makes the move.
@@ -261,12 +693,15 @@ class Board():
         if not type(input) == type(5):
             input = int(input) if input.isdigit() else None
 
-        if (input is not None) and (input in self.legal_moves):
+        if (input is not None) and 0 <= input < self.size and not (
+                    (self.x_bits | self.o_bits) >> input) & 1:
             item = 'X' if self.x_turn else 'O'
             self.insert(item, input)
             self.moves.append(input)
-            self.legal_moves = self.generate_legal_moves()
+            self.legal_moves.remove(input)
             self.x_turn = not self.x_turn
+            self.key ^= zobrist_table(self.width)[2]
+            self.sym_keys ^= symmetric_zobrist_table(self.width)[2]
             return True
         else:
             return False
@@ -280,132 +715,836 @@ class Board():
         """
         most_row_x = 0
         most_row_o = 0
-        board = self.board_list
-        # Checks every horizontal
-        for horizontal_list in board:
-            if all([item != 'O' for item in horizontal_list]):
-                most_row_x = max(most_row_x, horizontal_list.count('X'))
-            if all([item != 'X' for item in horizontal_list]):
-                most_row_o = max(most_row_o, horizontal_list.count('O'))
-        # Checks every vertical
-        for vertical_list in zip(*board):
-            if all([item != 'O' for item in vertical_list]):
-                most_row_x = max(most_row_x, vertical_list.count('X'))
-            if all([item != 'X' for item in vertical_list]):
-                most_row_o = max(most_row_o, vertical_list.count('O'))
-        # Checks the diagonal from top left
-        diag_list = []
-        index = 0
-        while index < self.width and index < self.height:
-            diag_list.append(board[index][index])
-            index += 1
-        if all([item != 'O' for item in diag_list]):
-            most_row_x = max(most_row_x, diag_list.count('X'))
-        if all([item != 'X' for item in diag_list]):
-            most_row_o = max(most_row_o, diag_list.count('O'))
-        # Checks the diagonal from top right
-        diag_list = []
-        index = self.width - 1
-        h_index = 0
-        while 0 <= index and index < self.width and h_index < self.height:
-            diag_list.append(board[h_index][index])
-            index -= 1
-            h_index += 1
-        if all([item != 'O' for item in diag_list]):
-            most_row_x = max(most_row_x, diag_list.count('X'))
-        if all([item != 'X' for item in diag_list]):
-            most_row_o = max(most_row_o, diag_list.count('O'))
+        for count_x, count_o in zip(self.line_x, self.line_o):
+            if not count_o:
+                if count_x > most_row_x:
+                    most_row_x = count_x
+            elif not count_x:
+                if count_o > most_row_o:
+                    most_row_o = count_o
         if most_row_x > most_row_o:
             return most_row_x / (self.width)
         elif most_row_o > most_row_x:
             return - most_row_o / (self.width)
         return 0
-    def ai(self, max_time) -> int:
+    def ai(self, max_time, table = None, randomize = True,
+           workers: int = 1, parallel: str = 'root',
+           database: bool = True, engine = None, stats = None,
+           max_nodes = None) -> int:
         """
         Returns the integer choice for an algorithm's guess for best move.
 
         An alpha-beta pruning minimax algorithm will determine the best move for
         the board based on eval_board. The ai will continue searching until it
-        finds a move or exceeds max_time.
+        finds a move or exceeds max_time. The search plays and undoes moves on
+        this board in place, so the board is back in its original state when
+        the ai returns.
+
+        The clock is checked every POLL_NODES nodes inside the tree, so the
+        search stops soon after max_time even in the middle of a deep
+        iteration, and the best move of the last finished iteration is
+        returned. When max_nodes is given the search also stops after
+        visiting that many nodes, which gives the same move on any machine
+        when max_time is float('inf') and randomize is False.
+
+        Search results are stored in a transposition table keyed by the
+        Zobrist key of each position. Passing the same table to every call
+        in a game lets later moves reuse the work of earlier ones.
+
+        Inside the tree the stored best move is searched first, then the two
+        killer moves that last caused a cutoff at the same ply, then the rest
+        of the moves by their history score. Moves with equal history scores
+        are tried in a random order when randomize is True.
+
+        When workers is more than 1 the search runs in a pool of worker
+        processes, which always use the default eval_board. With parallel set
+        to 'root' the root moves are split across the workers by
+        tttparallel.parallel_ai. With parallel set to 'smp' every worker
+        searches the whole tree and they share one transposition table, as in
+        tttparallel.smp_ai. The pools are kept between calls. Node counts
+        are not shared between processes, so max_nodes and stats are ignored
+        when workers is more than 1.
+
+        When database is True and tttdatabase has a perfect play file for the
+        board size, the move is read from the file instead of searched.
+
+        When an engine is given, it searches the board with the state it kept
+        from earlier moves of the game, and table, randomize, and workers are
+        ignored.
+
+        When stats is given, a single process search records its depth,
+        nodes, evaluations, table hits, cutoffs, and principal variation in
+        it, and calls its callback after every iteration. Searches without
+        stats only keep a few counters.
 
         Parameter max_time: The approximate maximum time for the algorithm.
         Precondition: max_time is an int or float and max_time > 0
+
+        Parameter table: The transposition table to use, or None for a new one.
+        Precondition: table is a TranspositionTable or None
+
+        Parameter randomize: Whether to break ties between moves randomly.
+        Precondition: randomize is a bool
+
+        Parameter workers: The number of processes to search with.
+        Precondition: workers is an int and workers > 0
+
+        Parameter parallel: How to split the search between workers.
+        Precondition: parallel is 'root' or 'smp'
+
+        Parameter database: Whether to use a perfect play database.
+        Precondition: database is a bool
+
+        Parameter engine: The engine to search with, or None.
+        Precondition: engine is an Engine or None
+
+        Parameter stats: The record to fill in, or None.
+        Precondition: stats is a SearchStats or None
+
+        Parameter max_nodes: The most nodes to search, or None for no limit.
+        Precondition: max_nodes is an int > 0 or None
+        """
+        if database:
+            import tttdatabase
+            known = tttdatabase.lookup(self)
+            if known is not None:
+                return known[1]
+        if engine is not None:
+            return engine.search(self, max_time, stats=stats,
+                                 max_nodes=max_nodes)[1]
+        if workers > 1:
+            import tttparallel
+            if parallel == 'smp':
+                return tttparallel.smp_ai(self, max_time, workers)
+            return tttparallel.parallel_ai(self, max_time, workers, randomize)
+        if table is None:
+            table = TranspositionTable()
+        table.new_search()
+        search = _Search(self, table, randomize, stats=stats)
+        return search.run(max_time, max_nodes=max_nodes)[1]
+
+    def ai_iter(self, max_time = float('inf'), table = None,
+                randomize = True, max_depth = None, max_nodes = None,
+                cancel = None, stats = None, database: bool = True):
+        """
+        Yields tuples (depth, move, value, pv) as the ai's search improves.
+
+        This is the search of ai, but instead of only returning the final
+        move it yields the best move found so far: first a guess before
+        searching, with depth 0 and value 0, and then the result of every
+        finished iteration of iterative deepening, with the value from X's
+        point of view and pv the principal variation, a list of moves
+        starting with move. The caller can stop early by setting cancel from
+        another thread or by closing the generator. Without a time limit,
+        node budget, max_depth, or cancel, the search runs until the game is
+        solved.
+
+        When database is True and tttdatabase has the position, its move is
+        yielded once with the exact result and nothing is searched. The board
+        is back in its original state whenever a tuple is yielded, and must
+        not be changed until the generator is finished or closed.
+
+        Parameter max_time: The approximate maximum time for the search.
+        Precondition: max_time is an int or float and max_time > 0
+
+        Parameter table: The transposition table to use, or None for a new one.
+        Precondition: table is a TranspositionTable or None
+
+        Parameter randomize: Whether to break ties between moves randomly.
+        Precondition: randomize is a bool
+
+        Parameter max_depth: The deepest iteration to search, or None.
+        Precondition: max_depth is an int > 0 or None
+
+        Parameter max_nodes: The most nodes to search, or None for no limit.
+        Precondition: max_nodes is an int > 0 or None
+
+        Parameter cancel: An event that stops the search when set, or None.
+        Precondition: cancel is a threading.Event or None
+
+        Parameter stats: The record to fill in, or None.
+        Precondition: stats is a SearchStats or None
+
+        Parameter database: Whether to use a perfect play database.
+        Precondition: database is a bool
+        """
+        if database:
+            import tttdatabase
+            known = tttdatabase.lookup(self)
+            if known is not None:
+                yield 0, known[1], known[0], [known[1]]
+                return
+        if table is None:
+            table = TranspositionTable()
+        table.new_search()
+        search = _Search(self, table, randomize, stats=stats)
+        for depth, move, value in search.iterate(max_time, max_depth, 1,
+                                                 max_nodes, cancel):
+            pv = search.principal_variation() if depth else [move]
+            yield depth, move, value, pv
+
+    def change_eval(self, func):
+        """
+        Changes the ai's board evaluation function.
+
+        Parameter func: The new evaluation function.
+        Precondition: func is a function that takes a board and returns a float
+        with -1 < float < 1
+        """
+        from types import MethodType
+        self.eval_board = MethodType(func, self)
+
+    # Scores every child of a board in one call, set by change_batch_eval
+    eval_children = None
+
+    def change_batch_eval(self, func):
+        """
+        Sets a function the ai uses to score the last ply in batches.
+
+        When the ai reaches a board one ply above its search depth, it calls
+        func once with every move from that board that does not end the game,
+        instead of calling eval_board once per child. This lets evaluation
+        functions with a high fixed cost per call, like neural networks, score
+        the whole frontier at once.
+
+        Parameter func: The new batch evaluation function, or None to score
+        every child with eval_board.
+        Precondition: func is None or a function that takes a board and a list
+        of legal moves and returns a list of float with -1 < float < 1, one
+        for the board after each move
+        """
+        from types import MethodType
+        self.eval_children = None if func is None else MethodType(func, self)
+
+class _Search():
+    """
+    The state of one alpha-beta search rooted at a board.
+
+    The search plays and undoes moves on the root board in place. It is used
+    by Board.ai and by the worker processes in tttparallel.
+
+    Attribute board: The board the search is rooted at
+    Invariant: board is a Board
+
+    Attribute table: The transposition table the search reads and writes
+    Invariant: table is a TranspositionTable
+
+    Attribute randomize: Whether ties between moves are broken randomly
+    Invariant: randomize is a bool
+
+    Attribute played: The number of moves on the board when the search began
+    Invariant: played is an int and played >= 0
+
+    Attribute killers: Two moves per ply that last caused a cutoff
+    Invariant: killers is a list of lists of two int or None
+
+    Attribute history: The history score of each move for each side
+    Invariant: history maps True and False to lists of int with len size
+
+    Attribute nodes: The number of positions visited so far
+    Invariant: nodes is an int and nodes >= 0
+
+    Attribute leaf_evals: The number of boards scored by the evaluation
+    Invariant: leaf_evals is an int and leaf_evals >= 0
+
+    Attribute probes: The number of table lookups so far
+    Invariant: probes is an int and probes >= 0
+
+    Attribute hits: The number of table lookups that found an entry
+    Invariant: hits is an int and 0 <= hits <= probes
+
+    Attribute cutoffs: The number of cutoffs at each ply
+    Invariant: cutoffs is a list of int with len size + 1
+
+    Attribute stats: The record of the search to fill in, or None
+    Invariant: stats is a SearchStats or None
+
+    Attribute deadline: The time.time() value the search must stop by, or None
+    Invariant: deadline is a float or None
+
+    Attribute max_nodes: The value of nodes the search must stop at, or None
+    Invariant: max_nodes is an int or None
+
+    Attribute cancel: An event that stops the search when set, or None
+    Invariant: cancel is a threading.Event or None
+
+    Attribute next_check: The value of nodes to check the limits at next
+    Invariant: next_check is an int
+    """
+    def __init__(self, board: Board, table: TranspositionTable,
+                 randomize: bool = True, killers: list = None,
+                 history: dict = None, stats: SearchStats = None):
+        """
+        Creates a search rooted at board.
+
+        Parameter board: The board to search.
+        Precondition: board is a Board
+
+        Parameter table: The transposition table to use.
+        Precondition: table is a TranspositionTable
+
+        Parameter randomize: Whether to break ties between moves randomly.
+        Precondition: randomize is a bool
+
+        Parameter killers: The killer moves to start from, or None for none.
+        Precondition: killers is a list of size + 1 lists of two int or None,
+        or None
+
+        Parameter history: The history scores to start from, or None for none.
+        Precondition: history maps True and False to lists of int with len
+        size, or is None
+
+        Parameter stats: The record of the search to fill in, or None.
+        Precondition: stats is a SearchStats or None
+        """
+        self.board = board
+        self.table = table
+        self.randomize = randomize
+        self.played = len(board.moves)
+        self.perms, self.inverses = symmetry_tables(board.width)
+        if killers is None:
+            killers = [[None, None] for _ in range(board.size + 1)]
+        if history is None:
+            history = {True: [0] * board.size, False: [0] * board.size}
+        self.killers = killers
+        self.history = history
+        self.nodes = 0
+        self.leaf_evals = 0
+        self.probes = 0
+        self.hits = 0
+        self.cutoffs = [0] * (board.size + 1)
+        self.stats = stats
+        self.deadline = None
+        self.max_nodes = None
+        self.cancel = None
+        self.next_check = POLL_NODES
+
+    def table_key(self, node: Board) -> tuple:
+        """Returns the table key of node and the symmetry that produced it."""
+        if self.table.canonical:
+            return node.canonical_key()
+        return node.key, 0
+
+    def root_moves(self) -> list:
+        """
+        Returns the root moves, keeping one of each set of symmetric moves.
         """
-        from functools import lru_cache
         from random import shuffle
-        # Minimax implementation with alpha-beta pruning
-        # Created by following the psuedocode from
-        # https://en.wikipedia.org/wiki/Alpha-beta_pruning
-        @lru_cache
-        def minimax(node: Board, depth: int, alpha, beta, max_player: bool):
-            # Exit condition
-            x = node.check_game_end()
-            if depth == 0 or x[0]:
-                if x[0]:
-                    return x[1]
-                return node.eval_board()
-            # Runs when it is x's turn
-            if max_player:
-                value = -float('inf')
-                for move in node.shuffled_legal_moves:
-                    child_board = node.create_copy()
-                    child_board.move(move)
-                    value = max(value,
-                            minimax(child_board, depth - 1, alpha, beta, False))
-                    if value >= beta:
-                        break
-                    alpha = max(alpha, value)
-                return value
-            # Runs when it is o's turn
-            else:
-                value = float('inf')
-                for move in node.shuffled_legal_moves:
-                    child_board = node.create_copy()
-                    child_board.move(move)
-                    value = min(value,
-                            minimax(child_board, depth - 1, alpha, beta, True))
-                    if value <= alpha:
-                        break
-                    beta = min(beta, value)
-                return value
+        board = self.board
+        moves = []
+        seen = set()
+        root_moves = board.legal_moves.copy()
+        if self.randomize:
+            shuffle(root_moves)
+        for move in root_moves:
+            board.move(move)
+            child = board.canonical_key()[0]
+            board.unmove()
+            if child not in seen:
+                seen.add(child)
+                moves.append(move)
+        return moves
 
-        from copy import copy
+    def set_limits(self, deadline = None, max_nodes = None, cancel = None):
+        """
+        Sets when minimax raises SearchAborted.
+
+        Parameter deadline: The time.time() value to stop at, or None.
+        Precondition: deadline is an int or float or None
+
+        Parameter max_nodes: The most nodes to search from now, or None.
+        Precondition: max_nodes is an int > 0 or None
+
+        Parameter cancel: An event that stops the search when set, or None.
+        Precondition: cancel is a threading.Event or None
+        """
+        self.deadline = deadline
+        self.cancel = cancel
+        self.max_nodes = None if max_nodes is None else self.nodes + max_nodes
+        self.next_check = self.nodes
+
+    def check_limits(self):
+        """
+        Raises SearchAborted if the deadline or node budget is reached, or
+        the search was cancelled.
+        """
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            raise SearchAborted()
+        if self.cancel is not None and self.cancel.is_set():
+            raise SearchAborted()
+        if self.deadline is not None:
+            import time
+            if time.time() >= self.deadline:
+                raise SearchAborted()
+        self.next_check = self.nodes + POLL_NODES
+        if self.max_nodes is not None:
+            self.next_check = min(self.next_check, self.max_nodes)
+
+    def run(self, max_time, max_depth = None, start_depth: int = 1,
+            max_nodes = None) -> tuple:
+        """
+        Returns a tuple (depth, move, value) of an iterative deepening search.
+
+        Searches the root moves one ply deeper on each iteration until the
+        time or node budget runs out, a win is proven, or the whole game has
+        been searched. An iteration that runs out is abandoned and the result
+        is from the last finished iteration. When no iteration finished,
+        depth is 0, value is 0, and move is the first root move, which is the
+        best move stored for the root if there is one.
+
+        Parameter max_time: The approximate maximum time for the search.
+        Precondition: max_time is an int or float and max_time > 0
+
+        Parameter max_depth: The deepest iteration to search, or None for no
+        limit.
+        Precondition: max_depth is an int > 0 or None
+
+        Parameter start_depth: The depth of the first iteration.
+        Precondition: start_depth is an int and start_depth > 0
+
+        Parameter max_nodes: The most nodes to search, or None for no limit.
+        Precondition: max_nodes is an int > 0 or None
+        """
+        for result in self.iterate(max_time, max_depth, start_depth,
+                                   max_nodes):
+            pass
+        return result
+
+    def iterate(self, max_time, max_depth = None, start_depth: int = 1,
+                max_nodes = None, cancel = None):
+        """
+        Yields a tuple (depth, move, value) for each iteration of run.
+
+        The first tuple is yielded before searching, with depth 0, value 0,
+        and the move run would return if no iteration finished. Then one
+        tuple is yielded after every finished iteration. The search stops as
+        in run, or soon after cancel is set. The board is in its original
+        state whenever a tuple is yielded, and must not be changed until the
+        generator is finished or closed.
+
+        Parameter max_time: The approximate maximum time for the search.
+        Precondition: max_time is an int or float and max_time > 0
+
+        Parameter max_depth: The deepest iteration to search, or None for no
+        limit.
+        Precondition: max_depth is an int > 0 or None
+
+        Parameter start_depth: The depth of the first iteration.
+        Precondition: start_depth is an int and start_depth > 0
+
+        Parameter max_nodes: The most nodes to search, or None for no limit.
+        Precondition: max_nodes is an int > 0 or None
+
+        Parameter cancel: An event that stops the search when set, or None.
+        Precondition: cancel is a threading.Event or None
+        """
         import time
         t1 = time.time()
-        moves = copy(self.shuffled_legal_moves)
+        self.set_limits(t1 + max_time if max_time != float('inf') else None,
+                        max_nodes, cancel)
+        # The nodes, evaluations, and time when the last iteration finished,
+        # and the nodes of that iteration, 0 before the first one
+        self.mark = (self.nodes, self.leaf_evals, t1, 0)
+        board = self.board
+        moves = self.root_moves()
+        key, sym = self.table_key(board)
+        entry = self.table.probe(key)
+        if entry is not None and entry[4] is not None:
+            hash_move = self.inverses[sym][entry[4]]
+            if hash_move in moves:
+                moves.remove(hash_move)
+                moves.insert(0, hash_move)
         ratings = []
-        depth = 0
-        best_guess = 0
-        while (time.time() - t1 < max_time):
-            depth += 1
-            for move in moves:
-                if (time.time() - t1 > max_time):
+        depth = start_depth - 1
+        try:
+            yield (0, moves[0], 0)
+            while (time.time() - t1 < max_time) and (
+                        max_depth is None or depth < max_depth) and (
+                        cancel is None or not cancel.is_set()):
+                depth += 1
+                for move in moves:
+                    if (time.time() - t1 > max_time):
+                        break
+                    board.move(move)
+                    ratings.append(self.minimax(
+                                board, depth, -1, 1, board.x_turn))
+                    board.unmove()
+                else:
+                    move_rating = list(zip(moves, ratings))
+                    move_rating.sort(key=lambda x: x[1], reverse=board.x_turn)
+                    best_guess = move_rating[0][1]
+                    moves = [i[0] for i in move_rating]
+                    self.store_root(depth + 1, best_guess, moves[0])
+                    result = (depth, moves[0], best_guess)
+                    if self.stats is not None:
+                        self.record_iteration(result)
+                    yield result
+                    if (best_guess == 1 and board.x_turn) or (
+                                best_guess == -1 and not board.x_turn):
+                        break
+                    if depth > len(board.legal_moves):
+                        break
+                    ratings.clear()
+        except SearchAborted:
+            pass
+        finally:
+            self.unwind()
+            if self.stats is not None:
+                self.record_totals(time.time() - t1)
+
+    def record_iteration(self, result: tuple):
+        """Adds a finished iteration with result (depth, move, value) to stats."""
+        import time
+        now = time.time()
+        nodes, leaf_evals, start, last = self.mark
+        iterations = self.stats.iterations
+        info = {'depth': result[0], 'move': result[1], 'value': result[2],
+                'nodes': self.nodes - nodes,
+                'leaf_evals': self.leaf_evals - leaf_evals,
+                'elapsed': now - start,
+                'branching': (self.nodes - nodes) / last if last else None,
+                'pv': self.principal_variation()}
+        iterations.append(info)
+        self.mark = (self.nodes, self.leaf_evals, now, self.nodes - nodes)
+        if self.stats.callback is not None:
+            self.stats.callback(info)
+
+    def record_totals(self, elapsed: float):
+        """Adds the totals of the search to stats."""
+        stats = self.stats
+        stats.nodes += self.nodes
+        stats.leaf_evals += self.leaf_evals
+        stats.probes += self.probes
+        stats.hits += self.hits
+        # The root never cuts off, so stats starts one ply below it
+        cutoffs = self.cutoffs[1:]
+        missing = len(cutoffs) - len(stats.cutoffs)
+        stats.cutoffs.extend([0] * max(0, missing))
+        for ply, count in enumerate(cutoffs):
+            stats.cutoffs[ply] += count
+        stats.elapsed += elapsed
+
+    def store_root(self, depth: int, value, move: int):
+        """Stores the result of a finished iteration for the root board."""
+        key, sym = self.table_key(self.board)
+        self.table.store(key, depth, EXACT, value, self.perms[sym][move])
+
+    def unwind(self):
+        """Undoes any moves left on the board by an interrupted search."""
+        while len(self.board.moves) > self.played:
+            self.board.unmove()
+
+    def principal_variation(self) -> list:
+        """
+        Returns the best line of play from the root stored in the table.
+
+        The line follows the best move stored for each position until a
+        position has none or the game ends.
+        """
+        board = self.board
+        pv = []
+        try:
+            while not board.check_game_end()[0]:
+                key, sym = self.table_key(board)
+                entry = self.table.probe(key)
+                if entry is None or entry[4] is None:
                     break
-                child_board = self.create_copy()
-                child_board.move(move)
-                ratings.append(minimax(
-                            child_board, depth, -1, 1, child_board.x_turn))
+                move = self.inverses[sym][entry[4]]
+                if ((board.x_bits | board.o_bits) >> move) & 1:
+                    break
+                pv.append(move)
+                board.move(move)
+        finally:
+            self.unwind()
+        return pv
+
+    def order_moves(self, node: Board, ply: int, hash_move) -> list:
+        """
+        Returns the legal moves of node in the order they should be searched.
+        """
+        from random import shuffle
+        moves = node.legal_moves.copy()
+        if self.randomize:
+            shuffle(moves)
+        moves.sort(key=self.history[node.x_turn].__getitem__, reverse=True)
+        occupied = node.x_bits | node.o_bits
+        for killer in reversed(self.killers[ply]):
+            if (killer is not None and killer != hash_move
+                    and not (occupied >> killer) & 1):
+                moves.remove(killer)
+                moves.insert(0, killer)
+        if hash_move is not None:
+            moves.remove(hash_move)
+            moves.insert(0, hash_move)
+        return moves
+
+    def record_cutoff(self, node: Board, ply: int, move: int, depth: int):
+        """Updates the killer moves and history scores after a cutoff."""
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        self.history[node.x_turn][move] += depth * depth
+        self.cutoffs[ply] += 1
+
+    def score_frontier(self, node: Board, moves: list, key: int, sym: int):
+        """
+        Returns the value of node by scoring all of its children in one batch.
+
+        Children that end the game get their result, and the rest are scored
+        by a single call to node.eval_children.
+
+        Parameter node: The board one ply above the search depth.
+        Precondition: node is a Board with eval_children set
+
+        Parameter moves: The legal moves of node.
+        Precondition: moves is a non-empty list of int
+
+        Parameter key: The table key of node.
+        Precondition: key is an int
+
+        Parameter sym: The symmetry that produced key.
+        Precondition: sym is an int and 0 <= sym < 8
+        """
+        scores = []
+        pending = []
+        self.nodes += len(moves)
+        for move in moves:
+            node.move(move)
+            end = node.check_game_end()
+            node.unmove()
+            if end[0]:
+                scores.append(end[1])
             else:
-                move_rating = list(zip(moves, ratings))
-                move_rating.sort(key=lambda x: x[1], reverse=self.x_turn)
-                best_guess = move_rating[0][1]
-                moves = [i[0] for i in move_rating]
-                if (moves[0] == 1 and self.x_turn) or (
-                            moves[0] == -1 and not self.x_turn):
-                    return moves[0]
-                if depth > len(self.legal_moves):
-                    return moves[0]
-                ratings.clear()
-        return moves[0]
-    def change_eval(self, func):
+                scores.append(None)
+                pending.append(move)
+        self.leaf_evals += len(pending)
+        if pending:
+            values = iter(node.eval_children(pending))
+            scores = [next(values) if score is None else score
+                      for score in scores]
+        pick = max if node.x_turn else min
+        best = pick(range(len(moves)), key=scores.__getitem__)
+        self.table.store(key, 1, EXACT, scores[best],
+                         self.perms[sym][moves[best]])
+        return scores[best]
+
+    # Minimax implementation with alpha-beta pruning
+    # Created by following the psuedocode from
+    # https://en.wikipedia.org/wiki/Alpha-beta_pruning
+    def minimax(self, node: Board, depth: int, alpha, beta, max_player: bool):
         """
-        Changes the ai's board evaluation function.
+        Returns the minimax value of node searched to depth.
 
-        Parameter func: The new evaluation function.
-        Precondition: func is a function that takes a board and returns a float
-        with -1 < float < 1
+        Parameter node: The board to search, this is the root board with
+        some moves played.
+        Precondition: node is a Board
+
+        Parameter depth: The number of plies left to search.
+        Precondition: depth is an int and depth >= 0
+
+        Parameter alpha: The value X is already assured of.
+        Precondition: alpha is an int or float
+
+        Parameter beta: The value O is already assured of.
+        Precondition: beta is an int or float
+
+        Parameter max_player: True when it is X's turn at node.
+        Precondition: max_player is a bool
         """
-        self.eval_board = func
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            self.check_limits()
+        # Exit condition
+        x = node.check_game_end()
+        if depth == 0 or x[0]:
+            if x[0]:
+                return x[1]
+            self.leaf_evals += 1
+            return node.eval_board()
+        # Uses a stored result when it was searched deep enough
+        table = self.table
+        key, sym = self.table_key(node)
+        entry = table.probe(key)
+        self.probes += 1
+        hash_move = None
+        if entry is not None:
+            self.hits += 1
+            if entry[1] >= depth:
+                if entry[2] == EXACT:
+                    return entry[3]
+                elif entry[2] == LOWER:
+                    alpha = max(alpha, entry[3])
+                else:
+                    beta = min(beta, entry[3])
+                if alpha >= beta:
+                    return entry[3]
+            if entry[4] is not None:
+                hash_move = self.inverses[sym][entry[4]]
+        ply = len(node.moves) - self.played
+        moves = self.order_moves(node, ply, hash_move)
+        if depth == 1 and node.eval_children is not None:
+            return self.score_frontier(node, moves, key, sym)
+        window = (alpha, beta)
+        best_move = None
+        # Runs when it is x's turn
+        if max_player:
+            value = -float('inf')
+            for move in moves:
+                node.move(move)
+                score = self.minimax(node, depth - 1, alpha, beta, False)
+                node.unmove()
+                if score > value:
+                    value = score
+                    best_move = move
+                if value >= beta:
+                    self.record_cutoff(node, ply, move, depth)
+                    break
+                alpha = max(alpha, value)
+        # Runs when it is o's turn
+        else:
+            value = float('inf')
+            for move in moves:
+                node.move(move)
+                score = self.minimax(node, depth - 1, alpha, beta, True)
+                node.unmove()
+                if score < value:
+                    value = score
+                    best_move = move
+                if value <= alpha:
+                    self.record_cutoff(node, ply, move, depth)
+                    break
+                beta = min(beta, value)
+        if value <= window[0]:
+            flag = UPPER
+        elif value >= window[1]:
+            flag = LOWER
+        else:
+            flag = EXACT
+        table.store(key, depth, flag, value, self.perms[sym][best_move])
+        return value
+
+class Engine():
+    """
+    A searcher that keeps its state between the moves of one game.
+
+    Board.ai starts every search from scratch. An engine instead keeps its
+    transposition table, killer moves, and history scores from move to move,
+    along with the principal variation of its last search. When the next
+    board is reached by playing along that variation, iterative deepening
+    starts that many plies shallower than the last finished iteration
+    instead of at depth 1, since the shallower iterations were already
+    searched. Killer moves are shifted to the new root and history scores
+    are halved, so older cutoffs count for less.
+
+    Attribute table: The transposition table kept for the game
+    Invariant: table is a TranspositionTable
+
+    Attribute randomize: Whether ties between moves are broken randomly
+    Invariant: randomize is a bool
+
+    Attribute killers: The killer moves of the last search, by ply
+    Invariant: killers is a list of lists of two int or None, or None
+    before the first search
+
+    Attribute history: The history scores of the last search
+    Invariant: history maps True and False to lists of int, or is None
+    before the first search
+
+    Attribute root: The moves played on the board of the last search
+    Invariant: root is a list of int, or None before the first search
+
+    Attribute pv: The principal variation of the last search
+    Invariant: pv is a list of int
+
+    Attribute depth: The depth of the last finished iteration
+    Invariant: depth is an int and depth >= 0
+    """
+    def __init__(self, megabytes: float = 16, randomize: bool = True):
+        """
+        Creates an engine with an empty transposition table.
+
+        Parameter megabytes: The approximate memory limit of the table.
+        Precondition: megabytes is an int or float and megabytes > 0
+
+        Parameter randomize: Whether to break ties between moves randomly.
+        Precondition: randomize is a bool
+        """
+        self.table = TranspositionTable(megabytes)
+        self.randomize = randomize
+        self.new_game()
+
+    def new_game(self):
+        """Forgets everything learned, to start a new game."""
+        self.table.clear()
+        self.killers = None
+        self.history = None
+        self.root = None
+        self.pv = []
+        self.depth = 0
+
+    def start_depth(self, board: Board) -> int:
+        """
+        Returns the depth the next search of board can start at.
+
+        Parameter board: The board to be searched.
+        Precondition: board is a Board
+        """
+        root = self.root
+        if root is None or board.moves[:len(root)] != root:
+            return 1
+        played = board.moves[len(root):]
+        if played != self.pv[:len(played)]:
+            return 1
+        return max(1, self.depth - len(played))
+
+    def search(self, board: Board, max_time, max_depth = None,
+               stats: SearchStats = None, max_nodes = None) -> tuple:
+        """
+        Returns a tuple (depth, move, value) from a search of board.
+
+        The result is as in _Search.run. The board is searched in place and
+        is back in its original state when the search returns.
+
+        Parameter board: The board to search.
+        Precondition: board is a Board and the game is not over
+
+        Parameter max_time: The approximate maximum time for the search.
+        Precondition: max_time is an int or float and max_time > 0
+
+        Parameter max_depth: The deepest iteration to search, or None for no
+        limit.
+        Precondition: max_depth is an int > 0 or None
+
+        Parameter stats: The record of the search to fill in, or None.
+        Precondition: stats is a SearchStats or None
+
+        Parameter max_nodes: The most nodes to search, or None for no limit.
+        Precondition: max_nodes is an int > 0 or None
+        """
+        start = self.start_depth(board)
+        if max_depth is not None:
+            start = min(start, max_depth)
+        root = self.root
+        if (self.history is None or len(self.killers) != board.size + 1
+                or root is None or board.moves[:len(root)] != root):
+            self.killers = [[None, None] for _ in range(board.size + 1)]
+            self.history = {True: [0] * board.size,
+                            False: [0] * board.size}
+        else:
+            shift = len(board.moves) - len(root)
+            self.killers = self.killers[shift:] + [
+                        [None, None] for _ in range(shift)]
+            for scores in self.history.values():
+                scores[:] = [score // 2 for score in scores]
+        self.table.new_search()
+        search = _Search(board, self.table, self.randomize, self.killers,
+                         self.history, stats)
+        result = search.run(max_time, max_depth, start, max_nodes)
+        self.root = board.moves.copy()
+        self.pv = search.principal_variation()
+        self.depth = result[0]
+        return result
 
 def new_board(size: int = 3):
     """
@@ -418,6 +1557,72 @@ def new_board(size: int = 3):
     """
     return Board(size)
 
+def _give_o_first_move(board: Board):
+    """
+    Makes it O's turn on a new board, so that O plays the first move.
+
+    Parameter board: The board to change.
+    Precondition: board is a Board with no moves played
+    """
+    board.x_turn = False
+    board.key ^= zobrist_table(board.width)[2]
+    board.sym_keys ^= symmetric_zobrist_table(board.width)[2]
+
+def board_from_flat(flat: list):
+    """
+    Returns the board described by a flattened board.
+
+    The list is in the format of Board.flatten, optionally followed by the
+    turn (1 for X, -1 for O) as in the inputs saved by tttdatasets. Without a
+    turn, it is X's turn when both players have played the same number of
+    cells. The order the moves were played in is unknown, so the move history
+    of the returned board alternates between the cells of each player in
+    index order, starting with the player with more cells, or with the player
+    to move when both have the same number. Replaying that history, as
+    decode_board does, gives back the same board.
+
+    Parameter flat: The flattened board.
+    Precondition: flat is a list of 1, -1, and 0 with len n * n or n * n + 1,
+    where the player to move has at most as many cells as the other player
+    and at most one fewer
+    """
+    size = int(round(len(flat) ** 0.5))
+    x_cells = [cell for cell in range(size * size) if flat[cell] == 1]
+    o_cells = [cell for cell in range(size * size) if flat[cell] == -1]
+    if len(flat) > size * size:
+        x_turn = flat[size * size] == 1
+    else:
+        x_turn = len(x_cells) == len(o_cells)
+    board = new_board(size)
+    if len(o_cells) > len(x_cells) or (
+                len(o_cells) == len(x_cells) and not x_turn):
+        _give_o_first_move(board)
+        x_cells, o_cells = o_cells, x_cells
+    # x_cells now holds the cells of the player who moved first
+    for first, second in zip(x_cells, o_cells):
+        board.move(first)
+        board.move(second)
+    if len(x_cells) > len(o_cells):
+        board.move(x_cells[-1])
+    return board
+
+def decode_board(data: bytes):
+    """
+    Returns the board encoded by Board.encode.
+
+    The moves are replayed in order, so the returned board has the same cells,
+    turn, and move history as the encoded one.
+
+    Parameter data: The encoded board.
+    Precondition: data is a bytes object returned by Board.encode
+    """
+    board = new_board(data[0] & 127)
+    if data[0] & 128:
+        _give_o_first_move(board)
+    for move in data[1:]:
+        board.move(move)
+    return board
+
 def play_2p(size: int = 3, max_time = 10):
     """
     Creates a command-line game for two players with the designated board size.
@@ -548,6 +1753,7 @@ def play_1p(size: int = 3, max_time = 10):
                 break
         if play:
             board = new_board(size)
+            engine = Engine()
             print(board)
             while True:
                 if player_x == board.x_turn:
@@ -560,7 +1766,7 @@ def play_1p(size: int = 3, max_time = 10):
                     print('AI thinking...')
                     import time
                     t1 = time.time()
-                    inp = board.ai(max_time)
+                    inp = board.ai(max_time, engine=engine)
                     print(f'AI chose {inp} in {time.time() - t1}s.')
                 if inp == 'restart' or inp == 're':
                     break
@@ -600,12 +1806,13 @@ def play_0p(size: int = 3, max_time = 10):
         size = 1
     print('Starting AI vs AI game...\n')
     board = new_board(size)
+    engine = Engine()
     print(board)
     while not board.check_game_end()[0]:
         import time
         t1 = time.time()
         print('AI thinking...')
-        choice = board.ai(max_time)
+        choice = board.ai(max_time, engine=engine)
         board.move(choice)
         print(f'AI chose {choice} in {time.time() - t1}s.')
         print(board)
@@ -1,21 +1,144 @@
 """
 A script for training a tensorflow model to evaluate tic tac toe boards.
 
-This script takes data generated by the tttdatasets script.
+This script takes data generated by the tttdatasets script, either a
+directory of shards or a pickle file from earlier versions.
+
+Shards are memory mapped with NumPy and streamed into tf.data a block at a
+time, so datasets larger than memory can be trained on. The shards and the
+blocks within them are read in a random order each epoch, and a shuffle
+buffer mixes the records of several blocks before they are batched. Pickle
+files are loaded into memory whole.
 
 Author: Jacob Dentes
 Date: 18 September 2021
 """
-import pickle
-import tensorflow as tf
+import tttdatasets
+import os
+import time
 
 NUM_LAYERS = 25
 INPUT_SIZE = 26  # Should be the number of sqaures plus 1.
 EPOCHS = 11
 MODEL_NAME = 'tf_ttt_model_5' # The name of the output file.
 
-TRAIN_DATA = 'nn_numbers_5.pkl' # The name of the pickle file with training data
-TEST_DATA = 'nn_tests_5.pkl' # The name of the pickle file with test data
+TRAIN_DATA = 'nn_numbers_5.pkl' # The name of the training dataset
+TEST_DATA = 'nn_tests_5.pkl' # The name of the test dataset
+
+BATCH_SIZE = 32
+SHUFFLE_BUFFER = 2 ** 16  # The number of records shuffled together
+BLOCK_RECORDS = 4096  # The number of records read from a shard at a time
+
+def read_index(directory: str) -> dict:
+    """
+    Returns the index of a sharded dataset.
+
+    Parameter directory: The directory holding the shards and the index.
+    Precondition: directory is a str naming a directory with an index
+    """
+    import json
+    with open(os.path.join(directory, tttdatasets.INDEX_FILE)) as f:
+        return json.load(f)
+
+def shard_blocks(directory: str, shuffle: bool = False):
+    """
+    Yields (inputs, outputs) arrays of the records in a sharded dataset.
+
+    Each shard is memory mapped and read BLOCK_RECORDS records at a time, so
+    only one block is in memory at once. inputs is a float32 array with a
+    row of cells and turn for each record, and outputs is a float32 array
+    with a single column of results. Search values are not read.
+
+    Parameter directory: The directory holding the shards and the index.
+    Precondition: directory is a str naming a directory with an index
+
+    Parameter shuffle: Whether to read the shards and blocks in random order.
+    Precondition: shuffle is a bool
+    """
+    import random
+    import numpy as np
+    index = read_index(directory)
+    cells = index['size'] * index['size']
+    shards = list(index['shards'])
+    if shuffle:
+        random.shuffle(shards)
+    for shard in shards:
+        records = np.memmap(os.path.join(directory, shard['file']),
+                            dtype=np.int8, mode='r',
+                            shape=(shard['records'], index['record_size']))
+        starts = list(range(0, shard['records'], BLOCK_RECORDS))
+        if shuffle:
+            random.shuffle(starts)
+        for start in starts:
+            block = records[start:start + BLOCK_RECORDS]
+            yield (block[:, :cells + 1].astype(np.float32),
+                   block[:, cells + 1:cells + 2].astype(np.float32))
+        del records
+
+def make_dataset(path: str, batch_size: int = BATCH_SIZE,
+                 shuffle: bool = True) -> tuple:
+    """
+    Returns a tuple (dataset, samples, input_size) for a tttdatasets dataset.
+
+    dataset is a batched and prefetched tf.data.Dataset of (inputs, outputs),
+    samples is the number of records in it, and input_size is the length of
+    each input.
+
+    Parameter path: The name of the dataset directory or pickle file.
+    Precondition: path is a str
+
+    Parameter batch_size: The number of records in each batch.
+    Precondition: batch_size is an int and batch_size > 0
+
+    Parameter shuffle: Whether to shuffle the records every epoch.
+    Precondition: shuffle is a bool
+    """
+    import numpy as np
+    import tensorflow as tf
+    if os.path.isdir(path):
+        index = read_index(path)
+        input_size = index['size'] * index['size'] + 1
+        samples = sum(shard['records'] for shard in index['shards'])
+        signature = (tf.TensorSpec((None, input_size), tf.float32),
+                     tf.TensorSpec((None, 1), tf.float32))
+        dataset = tf.data.Dataset.from_generator(
+                    lambda: shard_blocks(path, shuffle),
+                    output_signature=signature).unbatch()
+    else:
+        pairs = list(tttdatasets.read_dataset(path))
+        inputs = np.array([pair[0] for pair in pairs], dtype=np.float32)
+        outputs = np.array([[pair[1]] for pair in pairs], dtype=np.float32)
+        del pairs
+        input_size = inputs.shape[1]
+        samples = len(inputs)
+        dataset = tf.data.Dataset.from_tensor_slices((inputs, outputs))
+    if shuffle:
+        dataset = dataset.shuffle(SHUFFLE_BUFFER)
+    dataset = dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+    return dataset, samples, input_size
+
+def samples_callback(tf, samples: int):
+    """
+    Returns a keras callback that logs the samples per second of each epoch.
+
+    The rate is printed and added to the epoch logs as samples_per_sec.
+
+    Parameter tf: The tensorflow module.
+    Precondition: tf is the imported tensorflow module
+
+    Parameter samples: The number of samples in an epoch.
+    Precondition: samples is an int and samples >= 0
+    """
+    class SamplesPerSecond(tf.keras.callbacks.Callback):
+        def on_epoch_begin(self, epoch, logs=None):
+            self.start = time.time()
+
+        def on_epoch_end(self, epoch, logs=None):
+            rate = samples / max(time.time() - self.start, 1e-9)
+            if logs is not None:
+                logs['samples_per_sec'] = rate
+            print(f'Epoch {epoch + 1}: {rate:.0f} samples/s')
+    return SamplesPerSecond()
 
 def main():
     # Get user input for file names and training size
@@ -26,31 +149,15 @@ def main():
     MODEL_NAME = input('Enter name for the final model: ')
 
 
-    # Load training data from pickled files
-    train_data = []  # About 15,000 boards to train on
-    test_data = []  # About 2,000 boards to test network accuracy on
-    with open(TRAIN_DATA, 'rb') as f:
-        train_data = pickle.load(f)
-    with open(TEST_DATA, 'rb') as f:
-        test_data = pickle.load(f)
-
-    INPUT_SIZE = len(train_data[0][0])
-
-    def make_list(x):
-        r_list = []
-        r_list.append(x)
-        return r_list
-
-    # Put the training data into a usable form
-    train_inputs = [i[0] for i in train_data]
-    train_outputs = [make_list(i[1]) for i in train_data]
-    del train_data
-    test_inputs = [i[0] for i in test_data]
-    test_outputs = [make_list(i[1]) for i in test_data]
-    del test_data
+    # Stream the datasets from their files
+    import tensorflow as tf
+    # About 15,000 boards to train on
+    train_data, train_size, INPUT_SIZE = make_dataset(TRAIN_DATA)
+    # About 2,000 boards to test network accuracy on
+    test_data, test_size, _ = make_dataset(TEST_DATA, shuffle=False)
 
-    print(len(train_inputs))
-    print(len(train_outputs))
+    print(train_size)
+    print(test_size)
 
     # Create the tensorflow sequential model
     model = tf.keras.models.Sequential()
@@ -60,8 +167,9 @@ def main():
     model.compile(optimizer='adam', loss='mse', metrics=['accuracy'])
 
     # Train the model, evaluate the success
-    model.fit(train_inputs, train_outputs, epochs=EPOCHS)
-    model.evaluate(test_inputs, test_outputs, verbose=2)
+    model.fit(train_data, epochs=EPOCHS,
+              callbacks=[samples_callback(tf, train_size)])
+    model.evaluate(test_data, verbose=2)
 
     model.save(MODEL_NAME)
 
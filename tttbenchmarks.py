@@ -0,0 +1,368 @@
+"""
+A script for benchmarking the tic tac toe programs.
+
+The startup benchmark imports each command-line entry point in a fresh
+interpreter with python -X importtime and reports how long the import took.
+Entry points that take longer than STARTUP_LIMIT to import are reported as
+regressions, and the script exits with a nonzero status when there are any.
+
+The search benchmark searches a fixed set of positions for each board size
+to a fixed depth and reports the time, nodes, and nodes per second of each.
+Searches never break ties randomly and the random generator is seeded, so
+the same code visits the same nodes on every run. Microbenchmarks time the
+Board methods the search calls most, and the latency of a neural network
+evaluation is timed when a model can be loaded.
+
+Before any benchmark, random positions are checked to survive a round trip
+through board_from_flat, Board.encode, and decode_board, and the script exits
+with a nonzero status when one does not.
+
+Results can be written as JSON and compared against a stored baseline, in
+which case timings more than TOLERANCE worse than the baseline are reported
+as regressions.
+"""
+import sys
+
+# The modules whose import time is checked by the startup benchmark
+ENTRY_POINTS = ['playttt', 'tftictactoe', 'tictactoe', 'traintfttt',
+                'tttdatasets']
+# The longest an entry point may take to import, in seconds
+STARTUP_LIMIT = 0.1
+
+# The positions searched for each board size, as moves from the empty board
+POSITIONS = {
+    3: {'empty': [], 'corner': [0], 'center reply': [0, 4],
+        'midgame': [0, 4, 8, 2]},
+    4: {'empty': [], 'opening': [5, 10], 'midgame': [0, 5, 10, 15, 3],
+        'late': [0, 5, 1, 6, 10, 2, 12, 9]},
+    5: {'empty': [], 'opening': [12, 6], 'midgame': [12, 6, 18, 0, 8, 16]},
+}
+# The depth each board size is searched to, None to search the whole game
+DEPTHS = {3: None, 4: 5, 5: 3}
+# The number of calls timed by each microbenchmark
+MICRO_CALLS = 20000
+# The number of times each position is searched, the fastest is kept
+SEARCH_RUNS = 3
+# How much worse than the baseline a timing may be before it is a regression
+TOLERANCE = 0.3
+# Timings shorter than this many seconds are too noisy to compare
+MIN_SECONDS = 0.005
+
+def import_time(module: str) -> float:
+    """
+    Returns the time in seconds it takes a fresh interpreter to import module.
+
+    The time is the cumulative import time python -X importtime reports for
+    the module, so interpreter startup itself is not counted.
+
+    Parameter module: The name of the module to import.
+    Precondition: module is a str naming a module in this directory
+    """
+    import os
+    import subprocess
+    directory = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             f'import {module}'], cwd=directory,
+                            capture_output=True, text=True, check=True)
+    # Lines look like 'import time:  self [us] | cumulative | name'
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1e6
+    return 0.0
+
+def startup(modules: list = None, limit: float = STARTUP_LIMIT,
+            runs: int = 3) -> dict:
+    """
+    Returns and prints the best import time of each entry point.
+
+    Returns a dict mapping each module to its import time in seconds, and
+    prints any module slower than limit as a regression.
+
+    Parameter modules: The modules to time, or None for ENTRY_POINTS.
+    Precondition: modules is a list of str or None
+
+    Parameter limit: The longest a module may take to import, in seconds.
+    Precondition: limit is an int or float and limit > 0
+
+    Parameter runs: How many times to import each module, the best is kept.
+    Precondition: runs is an int and runs > 0
+    """
+    times = {}
+    for module in modules or ENTRY_POINTS:
+        times[module] = min(import_time(module) for _ in range(runs))
+        status = 'ok' if times[module] <= limit else 'REGRESSION'
+        print(f'{module}: {times[module] * 1000:.1f} ms {status}')
+    return times
+
+def search(size: int, seed: int = 0) -> dict:
+    """
+    Returns and prints the search results for the positions of a board size.
+
+    Each position in POSITIONS is searched SEARCH_RUNS times to DEPTHS[size]
+    with a new transposition table, and the fastest search is kept. Returns
+    a dict mapping each position name to a dict with the depth reached, the
+    move and value found, the seconds taken, the nodes visited, and the
+    nodes per second.
+
+    Parameter size: The width and height of the board.
+    Precondition: size is a key of POSITIONS
+
+    Parameter seed: The seed of the random generator.
+    Precondition: seed is an int
+    """
+    import random
+    import time
+    import tictactoe
+    results = {}
+    for name, moves in POSITIONS[size].items():
+        board = tictactoe.new_board(size)
+        for move in moves:
+            board.move(move)
+        seconds = float('inf')
+        for _ in range(SEARCH_RUNS):
+            random.seed(seed)
+            table = tictactoe.TranspositionTable()
+            table.new_search()
+            search = tictactoe._Search(board, table, randomize=False)
+            t1 = time.perf_counter()
+            depth, move, value = search.run(float('inf'), DEPTHS[size])
+            seconds = min(seconds, time.perf_counter() - t1)
+        results[name] = {'depth': depth, 'move': move, 'value': value,
+                         'seconds': seconds, 'nodes': search.nodes,
+                         'nodes_per_second': search.nodes / seconds}
+        print(f'{size}x{size} {name}: depth {depth}, {seconds:.3f} s, ' +
+              f'{search.nodes} nodes, {search.nodes / seconds:.0f} nodes/s')
+    return results
+
+def micro(calls: int = MICRO_CALLS) -> dict:
+    """
+    Returns and prints the time of one call of each hot Board method.
+
+    The methods are timed on a 4x4 board in the middle of a game. Returns a
+    dict mapping each method to its time per call in seconds.
+
+    Parameter calls: The number of calls to time for each method.
+    Precondition: calls is an int and calls > 0
+    """
+    import timeit
+    import tictactoe
+    board = tictactoe.new_board(4)
+    for move in POSITIONS[4]['midgame']:
+        board.move(move)
+    move = board.legal_moves[0]
+
+    def move_unmove():
+        board.move(move)
+        board.unmove()
+
+    methods = {'check_game_end': board.check_game_end,
+               'eval_board': board.eval_board,
+               'move': move_unmove,
+               'create_copy': board.create_copy}
+    results = {}
+    for name, method in methods.items():
+        results[name] = min(timeit.repeat(method, number=calls,
+                                          repeat=5)) / calls
+        print(f'{name}: {results[name] * 1e9:.0f} ns')
+    return results
+
+def nn_latency(size: int = 4, calls: int = 200) -> dict:
+    """
+    Returns and prints the latency of neural network evaluations, or None.
+
+    The NumPy model from tttnumpy is used when it can be loaded, and the
+    tensorflow model from tftictactoe otherwise. Returns None when neither
+    can be loaded. Otherwise returns a dict with the backend, the seconds
+    for one eval, and the seconds per child of one eval_children call.
+
+    Parameter size: The width and height of the board the model is for.
+    Precondition: size is a key of tftictactoe.models
+
+    Parameter calls: The number of evaluations to time.
+    Precondition: calls is an int and calls > 0
+    """
+    import timeit
+    import tictactoe
+    import tftictactoe
+    try:
+        import tttnumpy
+        model = tttnumpy.load(size)
+        backend = 'numpy'
+    except (ImportError, OSError):
+        try:
+            model = tftictactoe.registry.get(size)
+            backend = 'tensorflow'
+        except (ImportError, OSError):
+            print('nn eval: no model could be loaded')
+            return None
+    board = tictactoe.new_board(size)
+    board.MODEL = model
+    board.CACHE = None
+    board.change_eval(tftictactoe.eval)
+    board.change_batch_eval(tftictactoe.eval_children)
+    moves = board.legal_moves.copy()
+    single = min(timeit.repeat(board.eval_board, number=calls,
+                               repeat=5)) / calls
+    batch = min(timeit.repeat(lambda: board.eval_children(moves),
+                              number=calls, repeat=5)) / calls
+    print(f'nn eval ({backend}): {single * 1e6:.0f} us, ' +
+          f'{batch / len(moves) * 1e6:.0f} us per child in a batch')
+    return {'backend': backend, 'eval': single,
+            'eval_children_per_child': batch / len(moves)}
+
+def check_encoding(positions: int = 500, seed: int = 0) -> list:
+    """
+    Returns and prints the positions that do not survive an encoding round trip.
+
+    Each position is a random game of random length on a random board size,
+    half of them with O moving first. Its flattened board, with and without
+    the turn, is rebuilt with board_from_flat, and the rebuilt board is
+    encoded and decoded. A position fails when a rebuilt or decoded board
+    differs from the original or its move history does not replay to it.
+    Returns a list of the flattened boards, with the turn, that failed.
+
+    Parameter positions: The number of positions to check.
+    Precondition: positions is an int and positions >= 0
+
+    Parameter seed: The seed of the random generator.
+    Precondition: seed is an int
+    """
+    import random
+    import tictactoe
+    rng = random.Random(seed)
+    failures = []
+    for _ in range(positions):
+        # An encoding with no moves gives an empty board, 128 for O first
+        o_first = 128 if rng.random() < 0.5 else 0
+        board = tictactoe.decode_board(
+            bytes([rng.choice(sorted(POSITIONS)) | o_first]))
+        for _ in range(rng.randrange(len(board.legal_moves) + 1)):
+            if board.check_game_end()[0]:
+                break
+            board.move(rng.choice(board.legal_moves))
+        flat = board.flatten() + [1 if board.x_turn else -1]
+        rebuilt = [tictactoe.board_from_flat(flat)]
+        if board.x_turn == (len(board.moves) % 2 == 0):
+            rebuilt.append(tictactoe.board_from_flat(flat[:-1]))
+        for other in rebuilt:
+            decoded = tictactoe.decode_board(other.encode())
+            if not (other == board and decoded == board and
+                    decoded.moves == other.moves and
+                    decoded.key == board.key):
+                failures.append(flat)
+                break
+    for flat in failures:
+        print(f'ENCODING {flat}')
+    return failures
+
+def run(sizes: list = None, seed: int = 0, nn: bool = True) -> dict:
+    """
+    Returns the results of every benchmark except startup.
+
+    The result is a dict with keys 'search', mapping each board size (as a
+    str, as in JSON) to its search results, 'micro', and 'nn'.
+
+    Parameter sizes: The board sizes to search, or None for all of POSITIONS.
+    Precondition: sizes is a list of keys of POSITIONS or None
+
+    Parameter seed: The seed of the random generator.
+    Precondition: seed is an int
+
+    Parameter nn: Whether to time neural network evaluations.
+    Precondition: nn is a bool
+    """
+    return {'search': {str(size): search(size, seed)
+                       for size in sizes or POSITIONS},
+            'micro': micro(),
+            'nn': nn_latency() if nn else None}
+
+def compare(results: dict, baseline: dict,
+            tolerance: float = TOLERANCE) -> list:
+    """
+    Returns and prints the regressions of results against a baseline.
+
+    A timing is a regression when it is more than tolerance slower than the
+    baseline, and nodes per second when it is more than tolerance lower.
+    Searches faster than MIN_SECONDS in the baseline are not compared.
+    A change in the nodes of a search means the search itself changed, so it
+    is printed as a note rather than a regression. Results missing from
+    either side are skipped. Returns a list of str describing regressions.
+
+    Parameter results: The results of run.
+    Precondition: results is a dict returned by run
+
+    Parameter baseline: The results of an earlier run.
+    Precondition: baseline is a dict returned by run, maybe loaded from JSON
+
+    Parameter tolerance: The fraction a result may be worse than baseline.
+    Precondition: tolerance is an int or float and tolerance >= 0
+    """
+    regressions = []
+
+    def check(name, new, old, higher_is_better = False):
+        if new is None or old is None or old == 0:
+            return
+        change = new / old - 1
+        if higher_is_better:
+            change = -change
+        if change > tolerance:
+            regressions.append(f'{name}: {old:.4g} -> {new:.4g}')
+
+    for size, positions in results['search'].items():
+        for name, result in positions.items():
+            old = baseline.get('search', {}).get(size, {}).get(name)
+            if old is None:
+                continue
+            label = f'{size}x{size} {name}'
+            if old['seconds'] >= MIN_SECONDS:
+                check(label + ' seconds', result['seconds'], old['seconds'])
+                check(label + ' nodes/s', result['nodes_per_second'],
+                      old['nodes_per_second'], True)
+            if result['nodes'] != old['nodes']:
+                print(f'note: {label} nodes changed from {old["nodes"]} ' +
+                      f'to {result["nodes"]}')
+    for name, seconds in results['micro'].items():
+        check(name, seconds, baseline.get('micro', {}).get(name))
+    if results.get('nn') and baseline.get('nn') and (
+                results['nn']['backend'] == baseline['nn']['backend']):
+        for name in ('eval', 'eval_children_per_child'):
+            check('nn ' + name, results['nn'][name], baseline['nn'][name])
+    for regression in regressions:
+        print('REGRESSION ' + regression)
+    return regressions
+
+def main():
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='Benchmark tic tac toe.')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline',
+                        help='compare the results to this JSON file')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random generator')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        choices=sorted(POSITIONS),
+                        help='board sizes to search')
+    parser.add_argument('--no-nn', action='store_true',
+                        help='skip the neural network benchmark')
+    parser.add_argument('--startup-only', action='store_true',
+                        help='only run the startup benchmark')
+    args = parser.parse_args()
+    times = startup()
+    failed = any(t > STARTUP_LIMIT for t in times.values())
+    failed = check_encoding(seed=args.seed) or failed
+    if not args.startup_only:
+        results = run(args.sizes, args.seed, not args.no_nn)
+        results['startup'] = times
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=1)
+        if args.baseline:
+            with open(args.baseline) as f:
+                failed = compare(results, json.load(f)) or failed
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
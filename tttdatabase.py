@@ -0,0 +1,192 @@
+"""
+A module for building and reading perfect play databases of small boards.
+
+The generator solves every position reachable from the empty board and writes
+the results to a file with one byte for every possible board, indexed by the
+board read as a base 3 number (0 for empty, 1 for X, 2 for O, cell 0 being the
+lowest digit). Bits 0 and 1 of a byte hold the result with perfect play and
+bits 2 to 7 hold the best move. Only the canonical version of each position,
+as chosen by Board.canonical_key, is stored, and its best move is in the
+frame of the canonical board.
+
+Positions are only reached with X moving first, so an entry is for the
+position with X to move when both players have the same number of cells and
+O to move otherwise. Boards where O moved first are not in the database.
+
+Board.ai memory maps the file for its board size, when it exists, and answers
+from it before searching. The files are ttt_perfect_3.bin (about 20 KB) and
+ttt_perfect_4.bin (about 41 MB). Run this script to generate them.
+"""
+import os
+import tictactoe
+
+# Results stored in bits 0 and 1 of each entry, 0 means not stored
+X_WINS = 1
+O_WINS = 2
+DRAW = 3
+# The result of a finished game for each check_game_end winner
+_RESULTS = {1: X_WINS, -1: O_WINS, 0: DRAW}
+# The largest board size a database can be built for
+MAX_SIZE = 4
+
+# Memory mapped databases by board size, None when there is no file
+_databases = {}
+
+def path(size: int) -> str:
+    """
+    Returns the file name of the database for a board size.
+
+    Parameter size: The width and height of the board.
+    Precondition: size is an int and 0 < size <= MAX_SIZE
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(directory, f'ttt_perfect_{size}.bin')
+
+def index(board, sym: int) -> int:
+    """
+    Returns the base 3 index of a board after one of the board symmetries.
+
+    Parameter board: The board to index.
+    Precondition: board is a tictactoe.Board
+
+    Parameter sym: The symmetry to apply, as numbered in symmetry_tables.
+    Precondition: sym is an int and 0 <= sym < 8
+    """
+    perm = tictactoe.symmetry_tables(board.width)[0][sym]
+    total = 0
+    for cell in range(board.size):
+        if (board.x_bits >> cell) & 1:
+            total += 3 ** perm[cell]
+        elif (board.o_bits >> cell) & 1:
+            total += 2 * 3 ** perm[cell]
+    return total
+
+def _solve(board, entries: dict) -> int:
+    """
+    Returns the result of board with perfect play and records its entry.
+
+    Every position below board that does not end the game gets an entry in
+    entries, keyed by its canonical base 3 index. Winning moves that end the
+    game at once are preferred over slower wins.
+
+    Parameter board: The board to solve.
+    Precondition: board is a tictactoe.Board
+
+    Parameter entries: The entries found so far.
+    Precondition: entries is a dict mapping int indices to int entries
+    """
+    end = board.check_game_end()
+    if end[0]:
+        return _RESULTS[end[1]]
+    sym = board.canonical_key()[1]
+    position = index(board, sym)
+    if position in entries:
+        return entries[position] & 3
+    win = X_WINS if board.x_turn else O_WINS
+    loss = O_WINS if board.x_turn else X_WINS
+    rank = {win: 2, DRAW: 1, loss: 0}
+    # Moves that end the game at once are searched first
+    moves = []
+    for move in board.legal_moves.copy():
+        board.move(move)
+        ends = board.check_game_end()[0]
+        board.unmove()
+        if ends:
+            moves.insert(0, move)
+        else:
+            moves.append(move)
+    best_move = moves[0]
+    best = None
+    for move in moves:
+        board.move(move)
+        result = _solve(board, entries)
+        board.unmove()
+        if best is None or rank[result] > rank[best]:
+            best = result
+            best_move = move
+    perm = tictactoe.symmetry_tables(board.width)[0][sym]
+    entries[position] = best | perm[best_move] << 2
+    return best
+
+def generate(size: int, file: str = None) -> int:
+    """
+    Solves every position of a board size and writes the database file.
+
+    Returns the number of positions stored.
+
+    Parameter size: The width and height of the board.
+    Precondition: size is an int and 0 < size <= MAX_SIZE
+
+    Parameter file: The name of the file to write, or None for path(size).
+    Precondition: file is a str or None
+    """
+    import sys
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 4 * size * size + 100))
+    entries = {}
+    _solve(tictactoe.new_board(size), entries)
+    data = bytearray(3 ** (size * size))
+    for position, entry in entries.items():
+        data[position] = entry
+    with open(file or path(size), 'wb') as f:
+        f.write(data)
+    _databases.pop(size, None)
+    return len(entries)
+
+def load(size: int):
+    """
+    Returns the memory mapped database for a board size, or None.
+
+    The file is mapped once and kept for later calls. Returns None when the
+    size is too large or the file has not been generated.
+
+    Parameter size: The width and height of the board.
+    Precondition: size is an int and size > 0
+    """
+    if size not in _databases:
+        _databases[size] = None
+        file = path(size) if size <= MAX_SIZE else None
+        if file is not None and os.path.exists(file) and (
+                    os.path.getsize(file) == 3 ** (size * size)):
+            import mmap
+            with open(file, 'rb') as f:
+                _databases[size] = mmap.mmap(f.fileno(), 0,
+                                             access=mmap.ACCESS_READ)
+    return _databases[size]
+
+def lookup(board):
+    """
+    Returns a tuple (result, move) for board from its database, or None.
+
+    result is 1 if X wins with perfect play, -1 if O wins, and 0 for a draw.
+    move is a best move for the player whose turn it is. Returns None when
+    there is no database for the board size, the game is over, O moved
+    first, or the position is not in the database.
+
+    Parameter board: The board to look up.
+    Precondition: board is a tictactoe.Board
+    """
+    database = load(board.width)
+    if database is None or board.check_game_end()[0]:
+        return None
+    # The index ignores the turn, which is only X's with equal cell counts
+    x_cells = bin(board.x_bits).count('1')
+    if board.x_turn != (x_cells == bin(board.o_bits).count('1')):
+        return None
+    sym = board.canonical_key()[1]
+    entry = database[index(board, sym)]
+    if not entry & 3:
+        return None
+    inverse = tictactoe.symmetry_tables(board.width)[1][sym]
+    result = {X_WINS: 1, O_WINS: -1, DRAW: 0}[entry & 3]
+    return result, inverse[entry >> 2]
+
+def main():
+    import time
+    size = int(input(f'Enter board size, at most {MAX_SIZE}: '))
+    t1 = time.time()
+    count = generate(size)
+    print(f'Stored {count} positions in {path(size)} ' +
+          f'in {time.time() - t1:.1f}s.')
+
+if __name__ == '__main__':
+    main()
@@ -6,23 +6,109 @@ random tictactoe boards and plays them to completion, recording the outcome of
 the board. It is intended to be used in conjunction with a minimax algorithm
 on tictactoe boards of size 4x4 or greater
 
+Datasets are written as append-only shards in a directory. Each shard is a
+binary file of fixed-width records of signed bytes: the cells of the board in
+the format of Board.flatten, the turn (1 for X, -1 for O), and the result of
+the game, optionally followed by the value the search gave the position,
+scaled by VALUE_SCALE. The file index.json lists the completed shards, so an
+interrupted run resumes after the last shard it finished and never holds more
+than one shard in memory. A shard can be read with
+numpy.fromfile(file, numpy.int8) or numpy.memmap and reshaped to
+(-1, record_size).
+
 Author: Jacob Dentes
 Date: 18 September 2021
 """
 import tictactoe
+import json
+import os
 import pickle
 import random
+from array import array
+
+INDEX_FILE = 'index.json'
+# The number of games sent to a worker at a time
+CHUNKSIZE = 4
+# Search values in [-1, 1] are stored as signed bytes scaled by this
+VALUE_SCALE = 127
 
 data_size = 0
 save_frequency = 0
 
-load_inputs = False
 board_size = 4
 think_time = 4
+record_trajectory = False
+add_symmetries = False
+record_values = False
 
-def eval(i):
+def init_worker(size: int, time, trajectory: bool = False,
+                symmetries: bool = False, values: bool = False):
+    """
+    Sets the game settings of a worker process.
+
+    Each worker also reseeds its random generator, as forked workers would
+    otherwise all play the same random openings.
+
+    Parameter size: The width and height of the boards to play.
+    Precondition: size is an int and size > 0
+
+    Parameter time: The max time per move in seconds.
+    Precondition: time is an int or float and time > 0
+
+    Parameter trajectory: Whether to record every position of each game.
+    Precondition: trajectory is a bool
+
+    Parameter symmetries: Whether to record the 8 symmetries of positions.
+    Precondition: symmetries is a bool
+
+    Parameter values: Whether to record the search value of positions.
+    Precondition: values is a bool
+    """
     global board_size
     global think_time
+    global record_trajectory
+    global add_symmetries
+    global record_values
+    board_size = size
+    think_time = time
+    record_trajectory = trajectory
+    add_symmetries = symmetries
+    record_values = values
+    random.seed()
+
+def search(board, engine):
+    """
+    Returns a tuple (move, value) of the ai's move and its search value.
+
+    The value is from X's point of view, the exact result when the move comes
+    from a perfect play database and otherwise the value the search found.
+
+    Parameter board: The board to search, which must not be over.
+    Precondition: board is a tictactoe.Board
+
+    Parameter engine: The engine used for the whole game.
+    Precondition: engine is a tictactoe.Engine
+    """
+    import tttdatabase
+    known = tttdatabase.lookup(board)
+    if known is not None:
+        return known[1], known[0]
+    depth, move, value = engine.search(board, think_time)
+    return move, value
+
+def eval(i):
+    """
+    Plays one game from a random position and returns its data points.
+
+    Returns a list of (input, output) pairs, or of (input, output, value)
+    when search values are recorded. Only the random starting position is
+    recorded unless record_trajectory is True, in which case every position
+    the ai moved from is. With add_symmetries, each position is recorded
+    once for each of its distinct symmetric versions.
+
+    Parameter i: The number of the game, unused.
+    Precondition: i is an int
+    """
     board = tictactoe.new_board(board_size)
     # Randomly play a random number of moves (undo move if game ends)
     for _ in range(random.randrange(board_size * board_size)):
@@ -31,54 +117,329 @@ def eval(i):
             break
         move = board.shuffled_legal_moves[0]
         board.move(move)
-    # Save board state (and turn) as a useful neural net input
-    input = board.flatten()
-    input.append(1 if board.x_turn else -1)
+    if board.check_game_end()[0]:
+        board.unmove()
+    # Save board states (and turn) as useful neural net inputs
+    inputs = []
+    values = []
     output = 0
+    engine = tictactoe.Engine()
     # Have our ai play through the rest of the game
     while True:
-        board.move(board.ai(think_time))
+        move, value = search(board, engine)
+        if record_trajectory or not inputs:
+            input = board.flatten()
+            input.append(1 if board.x_turn else -1)
+            inputs.append(input)
+            values.append(value)
+        board.move(move)
         game_res = board.check_game_end()
         if game_res[0]:
-            # Record the result of the game as the answer to the board state
+            # Record the result of the game as the answer to the board states
             output = game_res[1]
             break
-    return input, output
+    samples = []
+    for input, value in zip(inputs, values):
+        versions = [input]
+        if add_symmetries:
+            versions = []
+            for sym in range(8):
+                version = tictactoe.transform_flat(input, sym, board_size)
+                if version not in versions:
+                    versions.append(version)
+        for version in versions:
+            if record_values:
+                samples.append((version, output, value))
+            else:
+                samples.append((version, output))
+    return samples
 
-def main():
-    file = input('Enter name of output file: ')
-    inp = input('Load file? y/n ')
+class ShardWriter():
+    """
+    A class writing data points to append-only dataset shards.
+
+    Records are kept in memory until shard_records of them are written, then
+    saved as the next shard and added to the index. Shards and the index are
+    written to a temporary file and renamed, so a crash never leaves a
+    partial shard in the index.
+
+    Attribute directory: The directory holding the shards and the index
+    Invariant: directory is a str
+
+    Attribute size: The width and height of the boards
+    Invariant: size is an int and size > 0
+
+    Attribute values: Whether records end with a search value
+    Invariant: values is a bool
+
+    Attribute record_size: The number of bytes in one record
+    Invariant: record_size is an int and record_size == size * size + 2,
+    plus 1 if values
+
+    Attribute shard_records: The number of records in each full shard
+    Invariant: shard_records is an int and shard_records > 0
+
+    Attribute shards: The index entries of the completed shards
+    Invariant: shards is a list of dicts with keys 'file' and 'records'
+
+    Attribute buffer: The records not yet saved in a shard
+    Invariant: buffer is an array of signed bytes with
+    len < shard_records * record_size
+    """
+    def __init__(self, directory: str, size: int, shard_records: int,
+                 values: bool = False):
+        """
+        Opens a dataset directory, resuming it if it already has an index.
+
+        Shard files that are not in the index, left by an interrupted run,
+        are removed. Raises ValueError if the index is for another board size
+        or record format.
+
+        Parameter directory: The directory to write the dataset to.
+        Precondition: directory is a str
+
+        Parameter size: The width and height of the boards.
+        Precondition: size is an int and size > 0, and equal to the size
+        in the index if the directory has one
+
+        Parameter shard_records: The number of records in each shard.
+        Precondition: shard_records is an int and shard_records > 0
+
+        Parameter values: Whether records end with a search value.
+        Precondition: values is a bool
+        """
+        self.directory = directory
+        self.size = size
+        self.values = values
+        self.record_size = size * size + 2 + values
+        self.shard_records = shard_records
+        self.shards = []
+        self.buffer = array('b')
+        os.makedirs(directory, exist_ok=True)
+        index = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index):
+            with open(index) as f:
+                saved = json.load(f)
+            if (saved['size'] != size or
+                    saved['record_size'] != self.record_size):
+                raise ValueError(f'{directory} holds a different dataset')
+            self.shards = saved['shards']
+        listed = {shard['file'] for shard in self.shards}
+        for name in os.listdir(directory):
+            if name.startswith('shard_') and name not in listed:
+                os.remove(os.path.join(directory, name))
+
+    def __len__(self) -> int:
+        """Returns the number of records saved in completed shards."""
+        return sum(shard['records'] for shard in self.shards)
+
+    def write(self, input: list, output: int, value = 0):
+        """
+        Adds a data point to the dataset, saving a shard when one is full.
+
+        Parameter input: The board in the format of Board.flatten followed
+        by the turn.
+        Precondition: input is a list of size * size + 1 ints in -1..1
+
+        Parameter output: The result of the game.
+        Precondition: output is 1, -1, or 0
+
+        Parameter value: The search value of the board, kept only if values.
+        Precondition: value is an int or float and -1 <= value <= 1
+        """
+        self.buffer.extend(input)
+        self.buffer.append(output)
+        if self.values:
+            self.buffer.append(round(value * VALUE_SCALE))
+        if len(self.buffer) >= self.shard_records * self.record_size:
+            self.flush()
+
+    def flush(self):
+        """Saves the buffered records as a shard, if there are any."""
+        if not self.buffer:
+            return
+        name = f'shard_{len(self.shards):05d}.bin'
+        file = os.path.join(self.directory, name)
+        with open(file + '.tmp', 'wb') as f:
+            self.buffer.tofile(f)
+        os.replace(file + '.tmp', file)
+        self.shards.append({'file': name,
+                            'records': len(self.buffer) // self.record_size})
+        self.buffer = array('b')
+        index = os.path.join(self.directory, INDEX_FILE)
+        with open(index + '.tmp', 'w') as f:
+            json.dump({'size': self.size, 'record_size': self.record_size,
+                       'values': self.values, 'shards': self.shards}, f,
+                      indent=1)
+        os.replace(index + '.tmp', index)
+
+def read_shards(directory: str, values: bool = False):
+    """
+    Yields the (input, output) pairs of a sharded dataset.
+
+    Only one shard is read into memory at a time. When values is True,
+    (input, output, value) tuples are yielded instead, where value is the
+    search value or None if the dataset has no values.
+
+    Parameter directory: The directory holding the shards and the index.
+    Precondition: directory is a str naming a directory with an index
+
+    Parameter values: Whether to yield search values.
+    Precondition: values is a bool
+    """
+    with open(os.path.join(directory, INDEX_FILE)) as f:
+        index = json.load(f)
+    record_size = index['record_size']
+    # The output is the last byte, or the one before the value
+    stored = index.get('values', False)
+    end = record_size - 1 - stored
+    for shard in index['shards']:
+        records = array('b')
+        with open(os.path.join(directory, shard['file']), 'rb') as f:
+            records.fromfile(f, shard['records'] * record_size)
+        for start in range(0, len(records), record_size):
+            record = records[start:start + record_size].tolist()
+            if not values:
+                yield record[:end], record[end]
+            elif stored:
+                yield record[:end], record[end], record[-1] / VALUE_SCALE
+            else:
+                yield record[:end], record[end], None
+
+def read_dataset(path: str, values: bool = False):
+    """
+    Yields the (input, output) pairs of a dataset.
+
+    The dataset is a directory of shards, or a pickle file of a list of
+    pairs as written by earlier versions of this script. When values is True,
+    (input, output, value) tuples are yielded as in read_shards.
+
+    Parameter path: The name of the dataset directory or pickle file.
+    Precondition: path is a str
+
+    Parameter values: Whether to yield search values.
+    Precondition: values is a bool
+    """
+    if os.path.isdir(path):
+        yield from read_shards(path, values)
+    else:
+        with open(path, 'rb') as f:
+            for input, output in pickle.load(f):
+                yield (input, output, None) if values else (input, output)
+
+def generate(directory: str, data_size: int, save_frequency: int,
+             size: int, time, workers: int = None,
+             chunksize: int = CHUNKSIZE, trajectory: bool = False,
+             symmetries: bool = False, values: bool = False) -> int:
+    """
+    Plays games on a pool of workers and writes their data points to shards.
+
+    A single pool plays the games, and results are written as soon as any
+    game finishes. Games stop once data_size data points are written, so
+    the last game may add a few more. Games per second and data points per
+    second are printed as the games come in. Returns the number of data
+    points written.
+
+    Parameter directory: The dataset directory, resumed if it has an index.
+    Precondition: directory is a str
+
+    Parameter data_size: The number of data points to add to the dataset.
+    Precondition: data_size is an int and data_size >= 0
+
+    Parameter save_frequency: The number of data points in each shard.
+    Precondition: save_frequency is an int and save_frequency > 0
+
+    Parameter size: The width and height of the boards to play.
+    Precondition: size is an int and size > 0
+
+    Parameter time: The max time per move in seconds.
+    Precondition: time is an int or float and time > 0
+
+    Parameter workers: The number of worker processes, or None for one per
+    core.
+    Precondition: workers is an int > 0 or None
+
+    Parameter chunksize: The number of games sent to a worker at a time.
+    Precondition: chunksize is an int and chunksize > 0
+
+    Parameter trajectory: Whether to record every position of each game.
+    Precondition: trajectory is a bool
+
+    Parameter symmetries: Whether to record the 8 symmetries of positions.
+    Precondition: symmetries is a bool
+
+    Parameter values: Whether to record the search value of positions.
+    Precondition: values is a bool
+    """
+    import time as timer
+    from multiprocessing import Pool
+    writer = ShardWriter(directory, size, save_frequency, values)
+    start = len(writer)
+    written = 0
+    played = 0
+    t1 = timer.time()
+    settings = (size, time, trajectory, symmetries, values)
+    # Every game gives at least one data point
+    with Pool(workers, init_worker, settings) as p:
+        for samples in p.imap_unordered(eval, range(data_size), chunksize):
+            for sample in samples:
+                writer.write(*sample)
+            played += 1
+            written += len(samples)
+            elapsed = max(timer.time() - t1, 1e-9)
+            print(f'\r{written}/{data_size} data points, ' +
+                  f'{played / elapsed:.2f} games/s, ' +
+                  f'{written / elapsed:.2f} data points/s', end='')
+            if written >= data_size:
+                break
+    writer.flush()
+    print()
+    return len(writer) - start
+
+def ask(prompt: str):
+    """
+    Returns True for a y answer to prompt, False for n, and None otherwise.
+
+    Parameter prompt: The question to ask.
+    Precondition: prompt is a str
+    """
+    inp = input(prompt + ' y/n ')
     if inp == 'y':
-        load_inputs = True
+        return True
     elif inp == 'n':
-        load_inputs = False
-    else:
-        print('Invalid input, quitting program.')
-        return
+        return False
+    print('Invalid input, quitting program.')
+    return None
 
+def main():
+    directory = input('Enter name of output directory: ')
     data_size = int(input('Enter number of data points to generate: '))
     save_frequency = int(input('Enter how often to save: '))
 
     board_size = int(input('Enter board size: '))
-    think_time = int(input('Enter max time per turn in seconds: '))
+    think_time = float(input('Enter max time per turn in seconds: '))
+
+    options = []
+    for prompt in ('Record every position of each game?',
+                   'Record the 8 symmetries of each position?',
+                   'Record search values?'):
+        options.append(ask(prompt))
+        if options[-1] is None:
+            return
+    trajectory, symmetries, values = options
 
     import time
     t1 = time.time()
 
-    io_list = []
-    if load_inputs:
-        with open(file, 'rb') as f:
-            io_list = pickle.load(f)
+    # An existing dataset is resumed after its last completed shard
+    done = len(ShardWriter(directory, board_size, save_frequency, values))
+    if done:
+        print(f'Resuming after {done} data points.')
+
+    generate(directory, max(0, data_size - done), save_frequency,
+             board_size, think_time, trajectory=trajectory,
+             symmetries=symmetries, values=values)
 
-    from multiprocessing import Pool
-    for i in range(data_size//save_frequency):
-        with Pool() as p:
-            io_list.extend(list(p.map(eval, range(save_frequency))))
-        print('\r' + str((i + 1) * save_frequency), end='')
-        with open(file, 'wb') as f:
-            pickle.dump(io_list, f)
-
-    print('\n', io_list)
     print(f'Finished in {time.time() - t1}.')
 
 if __name__ == '__main__':
@@ -0,0 +1,157 @@
+"""
+A module for running the tic tac toe models with NumPy instead of tensorflow.
+
+The provided models are stacks of Dense layers with tanh activations, so their
+weights can be exported once to a compact .npz file and evaluated with a few
+matrix products. A NumpyModel can be given to tftictactoe in place of a
+tensorflow model, since it is called the same way, and it supports float32,
+float64, and int8 inference for single boards or batches of boards.
+
+Exporting needs tensorflow, running an exported model only needs NumPy.
+"""
+import numpy as np
+
+# The exported weight files for each board size
+weight_files = {4: 'tf_ttt_model.npz', 5: 'tf_ttt_model_5.npz'}
+
+def export_weights(model_dir: str, path: str):
+    """
+    Exports the weights of a saved tensorflow model to an .npz file.
+
+    The file holds the kernel and bias of layer i as 'kernel_i' and 'bias_i'
+    and the name of every layer's activation in 'activations'.
+
+    Parameter model_dir: The directory of the saved tensorflow model.
+    Precondition: model_dir is a str naming a model of Dense layers
+
+    Parameter path: The name of the .npz file to write.
+    Precondition: path is a str
+    """
+    import tensorflow as tf
+    model = tf.keras.models.load_model(model_dir)
+    arrays = {}
+    activations = []
+    for index, layer in enumerate(model.layers):
+        kernel, bias = layer.get_weights()
+        arrays[f'kernel_{index}'] = kernel.astype(np.float32)
+        arrays[f'bias_{index}'] = bias.astype(np.float32)
+        activations.append(layer.activation.__name__)
+    np.savez_compressed(path, activations=np.array(activations), **arrays)
+
+class NumpyModel():
+    """
+    A Dense tanh model evaluated with NumPy.
+
+    Calling the model works like calling a tensorflow model: it takes an array
+    of inputs, one row per board, and returns an array with one column of
+    values. A single input row is also accepted.
+
+    With dtype 'int8' the kernels are quantized to 8 bit integers with one
+    scale per output column. The layer inputs, which are all between -1 and
+    1, are quantized to 8 bits as well, so each layer is an integer matrix
+    product followed by a float rescale.
+
+    Attribute dtype: The type used for inference
+    Invariant: dtype is 'float32', 'float64', or 'int8'
+
+    Attribute kernels: The kernel of each layer
+    Invariant: kernels is a list of 2D arrays, int32 holding int8 values when
+    dtype is 'int8'
+
+    Attribute scales: The rescale factor of each kernel column, or None
+    Invariant: scales is a list of 1D arrays when dtype is 'int8', else None
+
+    Attribute biases: The bias of each layer
+    Invariant: biases is a list of 1D arrays with the same len as kernels
+    """
+    def __init__(self, path: str, dtype: str = 'float32'):
+        """
+        Loads a model exported by export_weights.
+
+        Parameter path: The name of the .npz file.
+        Precondition: path is a str naming a file written by export_weights
+
+        Parameter dtype: The type to use for inference.
+        Precondition: dtype is 'float32', 'float64', or 'int8'
+        """
+        self.dtype = dtype
+        float_type = np.float64 if dtype == 'float64' else np.float32
+        with np.load(path) as data:
+            layers = len(data['activations'])
+            for activation in data['activations']:
+                if activation != 'tanh':
+                    raise ValueError(f'Unsupported activation {activation}')
+            kernels = [data[f'kernel_{i}'] for i in range(layers)]
+            self.biases = [data[f'bias_{i}'].astype(float_type)
+                           for i in range(layers)]
+        if dtype == 'int8':
+            self.kernels = []
+            self.scales = []
+            for kernel in kernels:
+                scale = np.abs(kernel).max(axis=0) / 127
+                scale[scale == 0] = 1
+                quantized = np.round(kernel / scale).astype(np.int8)
+                self.kernels.append(quantized.astype(np.int32))
+                self.scales.append((scale / 127).astype(np.float32))
+        else:
+            self.kernels = [kernel.astype(float_type) for kernel in kernels]
+            self.scales = None
+
+    def __call__(self, input, training: bool = False):
+        """
+        Returns an array of shape (n, 1) with the value of each input row.
+
+        Parameter input: The model inputs, a flattened board and the turn.
+        Precondition: input is an array-like of shape (n, squares + 1) or
+        (squares + 1,)
+
+        Parameter training: Ignored, accepted for tensorflow compatibility.
+        Precondition: training is a bool
+        """
+        x = np.atleast_2d(np.asarray(input))
+        if self.scales is None:
+            x = x.astype(self.kernels[0].dtype, copy=False)
+            for kernel, bias in zip(self.kernels, self.biases):
+                x = np.tanh(x @ kernel + bias)
+            return x
+        for kernel, scale, bias in zip(self.kernels, self.scales,
+                                       self.biases):
+            quantized = np.round(x * 127).astype(np.int32)
+            x = np.tanh((quantized @ kernel) * scale + bias)
+        return x
+
+    def predict(self, input):
+        """
+        Returns an array of shape (n, 1) with the value of each input row.
+
+        Parameter input: The model inputs, a flattened board and the turn.
+        Precondition: input is an array-like of shape (n, squares + 1) or
+        (squares + 1,)
+        """
+        return self(input)
+
+def load(size: int, dtype: str = 'float32'):
+    """
+    Returns the exported NumpyModel for a board size.
+
+    Parameter size: The width and height of the board.
+    Precondition: size is an int and size is a key of weight_files
+
+    Parameter dtype: The type to use for inference.
+    Precondition: dtype is 'float32', 'float64', or 'int8'
+    """
+    import os
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return NumpyModel(os.path.join(directory, weight_files[size]), dtype)
+
+def main():
+    import os
+    directory = os.path.dirname(os.path.abspath(__file__))
+    import tftictactoe
+    for size, name in weight_files.items():
+        model_dir = os.path.join(directory, tftictactoe.models[size])
+        export_weights(model_dir, os.path.join(directory, name))
+        print(f'Exported {model_dir} to {name}.')
+
+if __name__ == '__main__':
+    main()
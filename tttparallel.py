@@ -0,0 +1,767 @@
+"""
+A module for searching tic tac toe boards with several processes.
+
+The root moves of a board are split across a pool of worker processes. Each
+iteration of the iterative deepening search first searches the best move from
+the previous iteration, then hands the remaining moves to the pool. The
+workers share the best value found so far through shared memory and use it as
+their alpha-beta window. Boards are sent to the workers with Board.encode
+rather than as pickled Board objects. The pool is kept between searches, so
+later moves of a game skip the process startup and the workers keep their
+transposition tables. shutdown stops the kept pools, and runs at exit.
+
+The module also has a lazy SMP search, where every worker searches the whole
+tree with a slightly different move order or depth and all of them share one
+transposition table held in shared memory. Its pool and table are kept
+between searches as well.
+
+For offline jobs, analyze_many searches many positions at once, handing them
+to a pool of workers in chunks and streaming the results back.
+
+Running this module as a script reports how the search speeds up as the
+number of worker processes grows, or labels a dataset with search values.
+"""
+import atexit
+import tictactoe
+import time
+
+class SharedTranspositionTable():
+    """
+    A transposition table held in shared memory so processes can share it.
+
+    The table works like tictactoe.TranspositionTable, but the entries are
+    packed into a fixed array of 64 bit words in a SharedMemory block. Each
+    slot is two words: key ^ data and data. Entries are written without
+    locks, and a read only counts when the two words xor back to the probed
+    key, so a slot torn by two processes writing at once reads as empty.
+
+    data packs the value as a 32 bit fixed point number in bits 0 to 31, the
+    depth in bits 32 to 39, the flag in bits 40 to 41, the move plus one (0
+    for None) in bits 42 to 49, and the generation in bits 50 to 57.
+
+    Attribute canonical: True when the table is keyed on canonical positions
+    Invariant: canonical is a bool
+
+    Attribute capacity: The number of slots in the table
+    Invariant: capacity is an int and capacity > 0
+
+    Attribute generation: The number of searches started, modulo 256
+    Invariant: generation is an int and 0 <= generation < 256
+
+    Attribute memory: The shared memory block holding the slots
+    Invariant: memory is a multiprocessing.shared_memory.SharedMemory
+
+    Attribute words: The slots as an array of 64 bit words
+    Invariant: words is a memoryview of format 'Q' with len 2 * capacity
+    """
+    ENTRY_BYTES = 16
+
+    def __init__(self, megabytes: float = 16, canonical: bool = True,
+                 name = None):
+        """
+        Creates a table of about megabytes, or attaches to an existing one.
+
+        Parameter megabytes: The size of a new table in megabytes.
+        Precondition: megabytes is an int or float and megabytes > 0
+
+        Parameter canonical: Whether to key the table on canonical positions.
+        Precondition: canonical is a bool
+
+        Parameter name: The name of the table to attach to, or None to create
+        a new one.
+        Precondition: name is a str or None
+        """
+        from multiprocessing import shared_memory
+        self.canonical = canonical
+        self.generation = 0
+        if name is None:
+            capacity = max(1, int(megabytes * 2 ** 20) // self.ENTRY_BYTES)
+            self.memory = shared_memory.SharedMemory(
+                        create=True, size=capacity * self.ENTRY_BYTES)
+            self.memory.buf[:] = bytes(len(self.memory.buf))
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.capacity = self.memory.size // self.ENTRY_BYTES
+        self.words = self.memory.buf[:self.capacity * self.ENTRY_BYTES].cast(
+                    'Q')
+
+    def __len__(self) -> int:
+        """Returns the number of filled slots."""
+        words = self.words
+        return sum(1 for i in range(1, 2 * self.capacity, 2) if words[i])
+
+    @property
+    def name(self) -> str:
+        """The name other processes use to attach to the table."""
+        return self.memory.name
+
+    def probe(self, key: int):
+        """
+        Returns the entry stored for key or None if there is no entry.
+
+        The entry is a tuple (key, depth, flag, value, move, generation) like
+        the entries of tictactoe.TranspositionTable.
+
+        Parameter key: The Zobrist key of the position.
+        Precondition: key is an int and 0 <= key < 2 ** 64
+        """
+        index = 2 * (key % self.capacity)
+        data = self.words[index + 1]
+        if not data or self.words[index] ^ data != key:
+            return None
+        move = (data >> 42) & 0xFF
+        return (key, (data >> 32) & 0xFF, (data >> 40) & 0x3,
+                ((data & 0xFFFFFFFF) - 2 ** 31) / 2 ** 30,
+                move - 1 if move else None, (data >> 50) & 0xFF)
+
+    def store(self, key: int, depth: int, flag: int, value, move):
+        """
+        Stores a search result for key using the depth-preferred policy.
+
+        Parameter key: The Zobrist key of the position.
+        Precondition: key is an int and 0 <= key < 2 ** 64
+
+        Parameter depth: The remaining depth the position was searched to.
+        Precondition: depth is an int and 0 <= depth < 256
+
+        Parameter flag: Whether value is exact or a bound.
+        Precondition: flag is tictactoe.EXACT, LOWER, or UPPER
+
+        Parameter value: The value found by the search.
+        Precondition: value is an int or float and -1 <= value <= 1
+
+        Parameter move: The best move found, or None.
+        Precondition: move is an int and 0 <= move < 255, or None
+        """
+        index = 2 * (key % self.capacity)
+        words = self.words
+        old = words[index + 1]
+        if old and words[index] ^ old != key and (
+                    (old >> 50) & 0xFF) == self.generation and (
+                    depth < (old >> 32) & 0xFF):
+            return
+        data = (int(round(value * 2 ** 30)) + 2 ** 31
+                | min(depth, 255) << 32 | flag << 40
+                | (0 if move is None else move + 1) << 42
+                | self.generation << 50)
+        words[index] = key ^ data
+        words[index + 1] = data
+
+    def new_search(self):
+        """Marks every stored entry as belonging to an earlier search."""
+        self.generation = (self.generation + 1) % 256
+
+    def clear(self):
+        """Empties every slot."""
+        self.memory.buf[:] = bytes(len(self.memory.buf))
+
+    def close(self, unlink: bool = False):
+        """
+        Detaches from the shared memory, and frees it when unlink is True.
+
+        Parameter unlink: Whether to free the shared memory block.
+        Precondition: unlink is a bool
+        """
+        self.words.release()
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+# The best root value found so far in the current iteration, shared by all
+# worker processes. It is a multiprocessing.Value set by _init_worker.
+_bound = None
+# The number of the parallel_ai call now running, shared by all worker
+# processes, so tasks left over from an earlier call leave _bound alone. It
+# is a multiprocessing.Value set by _init_worker and guarded by _bound's lock.
+_current = None
+# The transposition table of a worker process, kept for the whole pool.
+_table = None
+# The number of the search the worker's table was last used for.
+_search_id = None
+# The pools kept by parallel_ai, mapping a number of workers to a tuple
+# (executor, bound, current).
+_root_pools = {}
+# The number of searches parallel_ai has started.
+_searches = 0
+# The pools kept by smp_ai, mapping a tuple (workers, megabytes) to a tuple
+# (executor, table).
+_smp_pools = {}
+
+def _init_worker(bound, current):
+    """
+    Sets up the shared bound and transposition table of a worker process.
+
+    Parameter bound: The shared best value of the current iteration.
+    Precondition: bound is a multiprocessing.Value of type 'd'
+
+    Parameter current: The shared number of the running parallel_ai call.
+    Precondition: current is a multiprocessing.Value of type 'q'
+    """
+    global _bound, _current, _table
+    _bound = bound
+    _current = current
+    _table = tictactoe.TranspositionTable()
+
+def _root_pool(workers: int) -> tuple:
+    """
+    Returns the kept (executor, bound, current) of parallel_ai, starting it
+    if needed.
+
+    Parameter workers: The number of worker processes.
+    Precondition: workers is an int and workers > 0
+    """
+    if workers not in _root_pools:
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import Value
+        bound = Value('d', 0.0)
+        current = Value('q', 0, lock=False)
+        executor = ProcessPoolExecutor(workers, initializer=_init_worker,
+                                       initargs=(bound, current))
+        _root_pools[workers] = executor, bound, current
+    return _root_pools[workers]
+
+def _smp_pool(workers: int, megabytes: float) -> tuple:
+    """
+    Returns the kept (executor, table) of smp_ai, starting it if needed.
+
+    Parameter workers: The number of worker processes.
+    Precondition: workers is an int and workers > 0
+
+    Parameter megabytes: The size of the shared table in megabytes.
+    Precondition: megabytes is an int or float and megabytes > 0
+    """
+    if (workers, megabytes) not in _smp_pools:
+        from concurrent.futures import ProcessPoolExecutor
+        table = SharedTranspositionTable(megabytes)
+        executor = ProcessPoolExecutor(workers,
+                                       initializer=_init_smp_worker,
+                                       initargs=(table.name,))
+        _smp_pools[workers, megabytes] = executor, table
+    return _smp_pools[workers, megabytes]
+
+def warm_up(workers: int, parallel: str = 'root', megabytes: float = 16):
+    """
+    Starts the kept pool for workers so the next search does not wait for it.
+
+    Parameter workers: The number of worker processes.
+    Precondition: workers is an int and workers > 0
+
+    Parameter parallel: The search to start the pool of.
+    Precondition: parallel is 'root' or 'smp'
+
+    Parameter megabytes: The size of the shared table of an smp pool.
+    Precondition: megabytes is an int or float and megabytes > 0
+    """
+    if parallel == 'smp':
+        executor = _smp_pool(workers, megabytes)[0]
+    else:
+        executor = _root_pool(workers)[0]
+    for future in [executor.submit(int) for _ in range(workers)]:
+        future.result()
+
+def shutdown():
+    """Stops the worker pools kept between searches and frees their tables."""
+    for executor, _, _ in _root_pools.values():
+        executor.shutdown(wait=True, cancel_futures=True)
+    _root_pools.clear()
+    for executor, table in _smp_pools.values():
+        executor.shutdown(wait=True, cancel_futures=True)
+        table.close(unlink=True)
+    _smp_pools.clear()
+
+atexit.register(shutdown)
+
+def _search_move(encoded: bytes, move: int, depth: int, deadline: float,
+                 randomize: bool, search_id: int):
+    """
+    Returns a tuple (move, value, exact) for one root move, or None.
+
+    The move is searched to depth with the shared bound as the alpha-beta
+    window. exact is False when the value is only a bound because the move
+    cannot beat the best move found so far. Returns None when the deadline
+    passes before or during the search. The shared bound is only raised
+    while search_id is still the running call and its deadline has not
+    passed, so a task outliving its call cannot disturb the next one.
+
+    Parameter encoded: The root board.
+    Precondition: encoded is a bytes object returned by Board.encode
+
+    Parameter move: The root move to search.
+    Precondition: move is a legal move on the root board
+
+    Parameter depth: The depth to search the move to.
+    Precondition: depth is an int and depth > 0
+
+    Parameter deadline: The time.time() value the search must end by.
+    Precondition: deadline is a float
+
+    Parameter randomize: Whether to break ties between moves randomly.
+    Precondition: randomize is a bool
+
+    Parameter search_id: The number of the parallel_ai call.
+    Precondition: search_id is an int
+    """
+    global _search_id
+    if time.time() > deadline:
+        return None
+    if search_id != _search_id:
+        _search_id = search_id
+        _table.new_search()
+    board = tictactoe.decode_board(encoded)
+    x_root = board.x_turn
+    board.move(move)
+    search = tictactoe._Search(board, _table, randomize)
+    search.set_limits(deadline if deadline != float('inf') else None)
+    if x_root:
+        alpha, beta = _bound.value, 1
+    else:
+        alpha, beta = -1, _bound.value
+    try:
+        value = search.minimax(board, depth, alpha, beta, board.x_turn)
+    except tictactoe.SearchAborted:
+        return None
+    if x_root:
+        exact = value > alpha or alpha <= -1
+    else:
+        exact = value < beta or beta >= 1
+    if exact:
+        with _bound.get_lock():
+            if _current.value != search_id or time.time() > deadline:
+                return None
+            if x_root and value > _bound.value:
+                _bound.value = value
+            elif not x_root and value < _bound.value:
+                _bound.value = value
+    return move, value, exact
+
+def _wait(futures: list, deadline: float) -> list:
+    """
+    Returns the results of futures, or None if they did not finish in time.
+
+    Parameter futures: The futures to wait for.
+    Precondition: futures is a list of concurrent.futures.Future
+
+    Parameter deadline: The time.time() value to stop waiting at.
+    Precondition: deadline is a float
+    """
+    from concurrent.futures import wait
+    timeout = None
+    if deadline != float('inf'):
+        timeout = max(0, deadline - time.time())
+    _, pending = wait(futures, timeout=timeout)
+    if pending:
+        # Started searches see the deadline and stop on their own
+        for future in pending:
+            future.cancel()
+        return None
+    results = [future.result() for future in futures]
+    if None in results:
+        return None
+    return results
+
+def parallel_ai(board, max_time, workers: int, randomize: bool = True,
+                max_depth = None) -> int:
+    """
+    Returns the best move for board found by a root-parallel search.
+
+    Works like Board.ai, but every iteration is spread over a pool of
+    workers processes. An iteration that does not finish by max_time is
+    dropped and the best move of the last finished iteration is returned.
+    Workers use the default eval_board. The pool for each number of workers
+    is started by the first call and kept for later ones, along with the
+    transposition table of every worker.
+
+    Parameter board: The board to find a move for.
+    Precondition: board is a tictactoe.Board with at least one legal move
+
+    Parameter max_time: The approximate maximum time for the search.
+    Precondition: max_time is an int or float and max_time > 0
+
+    Parameter workers: The number of worker processes.
+    Precondition: workers is an int and workers > 0
+
+    Parameter randomize: Whether to break ties between moves randomly.
+    Precondition: randomize is a bool
+
+    Parameter max_depth: The deepest iteration to search, or None for no limit.
+    Precondition: max_depth is an int > 0 or None
+    """
+    global _searches
+    deadline = time.time() + max_time
+    search = tictactoe._Search(board, tictactoe.TranspositionTable(),
+                               randomize)
+    moves = search.root_moves()
+    encoded = board.encode()
+    x_root = board.x_turn
+    worst = -1.0 if x_root else 1.0
+    executor, bound, current = _root_pool(workers)
+    _searches += 1
+    with bound.get_lock():
+        current.value = _searches
+    depth = 0
+    try:
+        while time.time() < deadline and (
+                    max_depth is None or depth < max_depth):
+            depth += 1
+            with bound.get_lock():
+                bound.value = worst
+            # The previous best move is searched alone to set the bound
+            first = _wait([executor.submit(_search_move, encoded, moves[0],
+                            depth, deadline, randomize, _searches)],
+                          deadline)
+            if first is None:
+                break
+            rest = _wait([executor.submit(_search_move, encoded, move, depth,
+                            deadline, randomize, _searches)
+                          for move in moves[1:]], deadline)
+            if rest is None:
+                break
+            results = first + rest
+            results.sort(key=lambda r: (r[1] if x_root else -r[1], r[2]),
+                         reverse=True)
+            moves = [r[0] for r in results]
+            best_guess = results[0][1]
+            if (best_guess == 1 and x_root) or (
+                        best_guess == -1 and not x_root):
+                break
+            if depth > len(board.legal_moves):
+                break
+    except BaseException:
+        # A pool interrupted mid search is not safe to keep
+        del _root_pools[workers]
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    return moves[0]
+
+def _init_smp_worker(name: str):
+    """
+    Attaches a worker process to the shared transposition table.
+
+    Parameter name: The name of the shared table.
+    Precondition: name is a str
+    """
+    global _table
+    _table = SharedTranspositionTable(name=name)
+
+def _smp_search(encoded: bytes, worker: int, max_time, max_depth,
+                generation: int) -> tuple:
+    """
+    Returns a tuple (depth, move, value) from one lazy SMP worker.
+
+    Odd numbered workers start one ply deeper than even numbered ones, and
+    every worker orders moves with its own random tie-breaking, so the
+    workers spread over the tree and fill the shared table for each other.
+
+    Parameter encoded: The root board.
+    Precondition: encoded is a bytes object returned by Board.encode
+
+    Parameter worker: The number of this worker.
+    Precondition: worker is an int and worker >= 0
+
+    Parameter max_time: The approximate maximum time for the search.
+    Precondition: max_time is an int or float and max_time > 0
+
+    Parameter max_depth: The deepest iteration to search, or None for no limit.
+    Precondition: max_depth is an int > 0 or None
+
+    Parameter generation: The generation of the shared table for this search.
+    Precondition: generation is an int and 0 <= generation < 256
+    """
+    import os
+    import random
+    random.seed(os.getpid() * 8 + worker)
+    _table.generation = generation
+    board = tictactoe.decode_board(encoded)
+    start_depth = 1 + worker % 2
+    if max_depth is not None:
+        start_depth = min(start_depth, max_depth)
+    search = tictactoe._Search(board, _table, worker > 0)
+    return search.run(max_time, max_depth, start_depth)
+
+def smp_ai(board, max_time, workers: int, max_depth = None,
+           megabytes: float = 16) -> int:
+    """
+    Returns the best move for board found by a lazy SMP search.
+
+    Every worker process runs its own iterative deepening search of board and
+    all of them share one SharedTranspositionTable. The move from the worker
+    that finished the deepest iteration is returned. Workers use the default
+    eval_board. The pool and table for each number of workers and table size
+    are started by the first call and kept for later ones, so later moves of
+    a game reuse the table.
+
+    Parameter board: The board to find a move for.
+    Precondition: board is a tictactoe.Board with at least one legal move
+
+    Parameter max_time: The approximate maximum time for the search.
+    Precondition: max_time is an int or float and max_time > 0
+
+    Parameter workers: The number of worker processes.
+    Precondition: workers is an int and workers > 0
+
+    Parameter max_depth: The deepest iteration to search, or None for no limit.
+    Precondition: max_depth is an int > 0 or None
+
+    Parameter megabytes: The size of the shared table in megabytes.
+    Precondition: megabytes is an int or float and megabytes > 0
+    """
+    from concurrent.futures import wait, FIRST_COMPLETED
+    deadline = time.time() + max_time
+    executor, table = _smp_pool(workers, megabytes)
+    table.new_search()
+    try:
+        futures = [executor.submit(_smp_search, board.encode(), worker,
+                                   max_time, max_depth, table.generation)
+                   for worker in range(workers)]
+        timeout = None
+        if deadline != float('inf'):
+            timeout = max(0, deadline - time.time())
+        done, _ = wait(futures, timeout=timeout)
+        if not done:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        # The deepest finished search wins, ties go to the lowest worker
+        results = [future.result() for future in futures if future in done]
+        return max(results, key=lambda r: r[0])[1]
+    except BaseException:
+        # A pool interrupted mid search is not safe to keep
+        del _smp_pools[workers, megabytes]
+        executor.shutdown(wait=False, cancel_futures=True)
+        table.close(unlink=True)
+        raise
+
+def smp_benchmark(depth: int = 4, worker_counts = None) -> list:
+    """
+    Returns and prints lazy SMP timings against a single process search.
+
+    Each fixed 4x4 and 5x5 position is searched to depth by one process with
+    an ordinary transposition table and then by smp_ai with each number of
+    workers. The pools are started and their shared tables emptied before
+    timing, so only the search is timed. Returns a list of tuples (size, moves, workers, seconds,
+    speedup), where workers is 0 for the single process search.
+
+    Parameter depth: The depth to search to.
+    Precondition: depth is an int and depth > 0
+
+    Parameter worker_counts: The numbers of workers to time, or None for
+    powers of two from 2 up to the number of cores.
+    Precondition: worker_counts is a sequence of int > 0 or None
+    """
+    import os
+    if worker_counts is None:
+        worker_counts = [2]
+        while worker_counts[-1] * 2 <= (os.cpu_count() or 1):
+            worker_counts.append(worker_counts[-1] * 2)
+    positions = [(4, ()), (4, (0, 5)), (5, ()), (5, (12, 0))]
+    report = []
+    for size, moves in positions:
+        board = tictactoe.new_board(size)
+        for move in moves:
+            board.move(move)
+        t1 = time.time()
+        tictactoe._Search(board, tictactoe.TranspositionTable(), False).run(
+                    float('inf'), depth)
+        base = time.time() - t1
+        report.append((size, moves, 0, base, 1.0))
+        print(f'{size}x{size} {list(moves)}: single process {base:.3f}s')
+        for workers in worker_counts:
+            warm_up(workers, 'smp')
+            _smp_pool(workers, 16)[1].clear()
+            t1 = time.time()
+            smp_ai(board, float('inf'), workers, depth)
+            elapsed = time.time() - t1
+            report.append((size, moves, workers, elapsed, base / elapsed))
+            print(f'{size}x{size} {list(moves)}: {workers} workers ' +
+                  f'{elapsed:.3f}s, speedup {base / elapsed:.2f}x')
+    return report
+
+def scaling_report(size: int = 4, moves = (), depth: int = 4,
+                   worker_counts = None) -> list:
+    """
+    Returns and prints how the search speeds up with more worker processes.
+
+    Times a search of the board to a fixed depth for each number of workers
+    and compares it to the time taken by one worker. The pools are started
+    before timing, so only the search is timed. Returns a list of tuples
+    (workers, seconds, speedup).
+
+    Parameter size: The width and height of the board.
+    Precondition: size is an int and size > 0
+
+    Parameter moves: The moves to play before searching.
+    Precondition: moves is a sequence of legal moves
+
+    Parameter depth: The depth to search to.
+    Precondition: depth is an int and depth > 0
+
+    Parameter worker_counts: The numbers of workers to time, or None for
+    powers of two up to the number of cores.
+    Precondition: worker_counts is a sequence of int > 0 or None
+    """
+    import os
+    if worker_counts is None:
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= (os.cpu_count() or 1):
+            worker_counts.append(worker_counts[-1] * 2)
+    board = tictactoe.new_board(size)
+    for move in moves:
+        board.move(move)
+    report = []
+    base = None
+    for workers in worker_counts:
+        warm_up(workers)
+        t1 = time.time()
+        parallel_ai(board, float('inf'), workers, randomize=False,
+                    max_depth=depth)
+        elapsed = time.time() - t1
+        if base is None:
+            base = elapsed
+        report.append((workers, elapsed, base / elapsed))
+        print(f'{workers} workers: {elapsed:.3f}s, ' +
+              f'speedup {base / elapsed:.2f}x, ' +
+              f'efficiency {base / elapsed / workers:.0%}')
+    return report
+
+def _analyze(task: tuple) -> dict:
+    """
+    Returns the analysis of one position for analyze_many.
+
+    Parameter task: The index of the position, the position, the time per
+    position, the node budget, and whether to break ties randomly.
+    Precondition: task is a tuple (int, list or bytes, int or float,
+    int or None, bool)
+    """
+    index, position, budget, max_nodes, randomize = task
+    if isinstance(position, (bytes, bytearray)):
+        board = tictactoe.decode_board(bytes(position))
+    else:
+        board = tictactoe.board_from_flat(list(position))
+    t1 = time.time()
+    end = board.check_game_end()
+    if end[0]:
+        return {'index': index, 'move': None, 'value': end[1], 'depth': 0,
+                'pv': [], 'nodes': 0, 'seconds': 0.0}
+    stats = tictactoe.SearchStats()
+    for depth, move, value, pv in board.ai_iter(budget, randomize=randomize,
+                                                max_nodes=max_nodes,
+                                                stats=stats):
+        pass
+    return {'index': index, 'move': move, 'value': value, 'depth': depth,
+            'pv': pv, 'nodes': stats.nodes, 'seconds': time.time() - t1}
+
+def analyze_many(positions, budget = 1, workers: int = None,
+                 chunksize: int = None, ordered: bool = True,
+                 max_nodes = None, randomize: bool = False,
+                 report: bool = False):
+    """
+    Yields the analysis of every position, searched on a pool of workers.
+
+    Each position is searched like Board.ai for budget seconds with its own
+    transposition table. When max_nodes is given the search runs for
+    max_nodes nodes instead and budget is ignored, so with randomize False
+    the results do not depend on the machine, the number of workers, or the
+    chunking. For each position a dict is yielded with the keys:
+        'index': the position's index in positions
+        'move': the best move, or None if the game is over
+        'value': the value of the move from X's point of view, or the result
+            if the game is over
+        'depth': the depth of the last finished iteration
+        'pv': the principal variation, a list of moves
+        'nodes': the nodes searched
+        'seconds': the time spent on the position
+    The results come in the order of positions when ordered is True, and as
+    soon as they finish otherwise. With report, the positions per second
+    and nodes per second so far are printed as the results come in.
+
+    Parameter positions: The positions to analyze, each either a flattened
+    board, optionally followed by the turn as in tttdatasets inputs, or the
+    bytes of Board.encode.
+    Precondition: positions is an iterable of lists or bytes
+
+    Parameter budget: The time to search each position for, in seconds,
+    used when max_nodes is None.
+    Precondition: budget is an int or float and budget > 0
+
+    Parameter workers: The number of worker processes, or None for one per
+    core.
+    Precondition: workers is an int > 0 or None
+
+    Parameter chunksize: The number of positions sent to a worker at a time,
+    or None to pick one from the number of positions.
+    Precondition: chunksize is an int > 0 or None
+
+    Parameter ordered: Whether to yield the results in input order.
+    Precondition: ordered is a bool
+
+    Parameter max_nodes: The most nodes to search per position, or None.
+    Precondition: max_nodes is an int > 0 or None
+
+    Parameter randomize: Whether to break ties between moves randomly.
+    Precondition: randomize is a bool
+
+    Parameter report: Whether to print the throughput as results come in.
+    Precondition: report is a bool
+    """
+    import os
+    from multiprocessing import Pool
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        # As Pool.map does, about four chunks per worker
+        count = len(positions) if hasattr(positions, '__len__') else 0
+        chunksize = max(1, count // (workers * 4)) if count else 16
+    if max_nodes is not None:
+        budget = float('inf')
+    tasks = ((index, position, budget, max_nodes, randomize)
+             for index, position in enumerate(positions))
+    done = 0
+    nodes = 0
+    t1 = time.time()
+    with Pool(workers) as pool:
+        imap = pool.imap if ordered else pool.imap_unordered
+        for result in imap(_analyze, tasks, chunksize):
+            done += 1
+            nodes += result['nodes']
+            if report:
+                elapsed = max(time.time() - t1, 1e-9)
+                print(f'\r{done} positions, {done / elapsed:.1f} ' +
+                      f'positions/s, {nodes / elapsed:.0f} nodes/s', end='')
+            yield result
+    if report:
+        print()
+
+def main():
+    inp = input('Benchmark root splitting, lazy SMP, or batch analysis? ' +
+                'Enter "root", "smp", or "analyze": ')
+    if inp == 'analyze':
+        import tttdatasets
+        path = input('Enter name of the dataset to analyze: ')
+        output = input('Enter name of the output directory: ')
+        nodes = input('Enter nodes per position, or nothing for a time ' +
+                      'limit: ')
+        max_nodes = int(nodes) if nodes else None
+        budget = 1
+        if max_nodes is None:
+            budget = float(input('Enter seconds per position: '))
+        pairs = list(tttdatasets.read_dataset(path))
+        writer = None
+        for (position, result), analysis in zip(pairs, analyze_many(
+                    [pair[0] for pair in pairs], budget,
+                    max_nodes=max_nodes, report=True)):
+            if writer is None:
+                size = int(round(len(position) ** 0.5))
+                writer = tttdatasets.ShardWriter(output, size, 10000,
+                                                 values=True)
+            writer.write(position, result, analysis['value'])
+        if writer is not None:
+            writer.flush()
+        print(f'Wrote {len(pairs)} positions with search values to ' +
+              f'{output}.')
+    elif inp == 'smp':
+        depth = int(input('Enter search depth: '))
+        smp_benchmark(depth)
+    else:
+        size = int(input('Enter board size: '))
+        depth = int(input('Enter search depth: '))
+        scaling_report(size, depth=depth)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""
+A module for proving the game theoretic value of tic tac toe positions.
+
+The solver is a depth-first proof number search (df-pn). To prove whether one
+player, the attacker, can force a win, every position keeps a proof number,
+the fewest leaves that still need proving to show the attacker wins, and a
+disproof number, the fewest leaves that need proving to show it does not.
+The search always expands the most proving position and stops as soon as the
+root is proven or disproven or the node budget runs out. Proving X's win and
+then O's win gives the exact result of a position: a win, a loss, or a draw
+when neither player can force a win.
+
+Proven results can relabel the datasets written by tttdatasets with exact
+values, and can be stored in a transposition table so Board.ai treats the
+positions as solved.
+"""
+import tictactoe
+
+# Proof and disproof numbers at or above this are infinite
+INFINITY = 10 ** 9
+# The fraction of max_entries a full table is cut down to
+LOW_WATER = 0.75
+
+class BudgetExceeded(Exception):
+    """Raised when a proof search visits more nodes than it was allowed."""
+    pass
+
+class ProofSolver():
+    """
+    A df-pn search proving whether one player can force a win.
+
+    Numbers are stored from the point of view of the player to move: phi is
+    the proof number at positions where the attacker moves and the disproof
+    number where the defender moves, and delta is the other one. A position
+    where phi is 0 is won for the player to move in the sense of the search.
+
+    A table too small for the proof makes the search forget and redo work, and
+    with no node budget it may then run for a very long time, so a small
+    max_entries should come with a max_nodes.
+
+    Attribute x_attacks: True when the solver proves wins for X, False for O
+    Invariant: x_attacks is a bool
+
+    Attribute table: The phi and delta of every position searched so far
+    Invariant: table is a dict mapping canonical keys to (phi, delta) tuples,
+    with len <= max_entries after every store
+
+    Attribute max_entries: The largest number of positions kept in table
+    Invariant: max_entries is an int and max_entries > 0
+
+    Attribute nodes: The number of positions expanded so far
+    Invariant: nodes is an int and nodes >= 0
+
+    Attribute max_nodes: The largest number of positions to expand, or None
+    Invariant: max_nodes is an int > 0 or None
+    """
+    def __init__(self, x_attacks: bool, max_entries: int = 2 ** 20,
+                 max_nodes = None):
+        """
+        Creates a solver with an empty table.
+
+        Parameter x_attacks: Whether to prove wins for X, or else for O.
+        Precondition: x_attacks is a bool
+
+        Parameter max_entries: The largest number of positions kept in memory.
+        Precondition: max_entries is an int and max_entries > 0
+
+        Parameter max_nodes: The largest number of positions to expand per
+        call to prove, or None for no limit.
+        Precondition: max_nodes is an int > 0 or None
+        """
+        self.x_attacks = x_attacks
+        self.table = {}
+        self.max_entries = max_entries
+        self.nodes = 0
+        self.max_nodes = max_nodes
+
+    def terminal(self, board):
+        """
+        Returns the (phi, delta) of a finished game, or None if it goes on.
+
+        Parameter board: The board to check.
+        Precondition: board is a tictactoe.Board
+        """
+        end = board.check_game_end()
+        if not end[0]:
+            return None
+        attacker_won = end[1] == (1 if self.x_attacks else -1)
+        # phi is 0 when the result is what the player to move is after
+        if attacker_won == (board.x_turn == self.x_attacks):
+            return 0, INFINITY
+        return INFINITY, 0
+
+    def lookup(self, board) -> tuple:
+        """
+        Returns the (phi, delta) of a board, (1, 1) if it was never searched.
+
+        Parameter board: The board to look up.
+        Precondition: board is a tictactoe.Board
+        """
+        known = self.terminal(board)
+        if known is not None:
+            return known
+        return self.table.get(board.canonical_key()[0], (1, 1))
+
+    def store(self, board, phi: int, delta: int):
+        """
+        Stores the (phi, delta) of a board, evicting entries when full.
+
+        A stored board becomes the newest entry. When the table is over
+        max_entries, the oldest entries, solved or not, are removed at once
+        until LOW_WATER of max_entries are left.
+
+        Parameter board: The board to store.
+        Precondition: board is a tictactoe.Board
+
+        Parameter phi: The phi of the board.
+        Precondition: phi is an int and 0 <= phi <= INFINITY
+
+        Parameter delta: The delta of the board.
+        Precondition: delta is an int and 0 <= delta <= INFINITY
+        """
+        key = board.canonical_key()[0]
+        self.table.pop(key, None)
+        self.table[key] = (phi, delta)
+        if len(self.table) > self.max_entries:
+            import itertools
+            kept = max(1, int(self.max_entries * LOW_WATER))
+            excess = len(self.table) - kept
+            for k in list(itertools.islice(self.table, excess)):
+                del self.table[k]
+
+    def mid(self, board, th_phi: int, th_delta: int):
+        """
+        Searches board until its phi or delta reaches its threshold.
+
+        Parameter board: The board to search, played and restored in place.
+        Precondition: board is a tictactoe.Board and the game is not over
+
+        Parameter th_phi: The threshold for the phi of the board.
+        Precondition: th_phi is an int and th_phi > 0
+
+        Parameter th_delta: The threshold for the delta of the board.
+        Precondition: th_delta is an int and th_delta > 0
+        """
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise BudgetExceeded()
+        moves = board.legal_moves.copy()
+        while True:
+            # phi is the smallest delta of a child and delta the sum of phis
+            children = []
+            for move in moves:
+                board.move(move)
+                children.append(self.lookup(board) + (move,))
+                board.unmove()
+            phi = min(child[1] for child in children)
+            delta = min(INFINITY, sum(child[0] for child in children))
+            if phi >= th_phi or delta >= th_delta:
+                self.store(board, phi, delta)
+                return
+            children.sort(key=lambda child: child[1])
+            child_phi, child_delta, move = children[0]
+            second = children[1][1] if len(children) > 1 else INFINITY
+            board.move(move)
+            self.mid(board, min(INFINITY, th_delta + child_phi - delta),
+                     min(th_phi, second + 1))
+            board.unmove()
+
+    def prove(self, board):
+        """
+        Returns True if the attacker can force a win on board, False if not.
+
+        Returns None when the node budget runs out first. The board is left
+        as it was.
+
+        Parameter board: The board to prove.
+        Precondition: board is a tictactoe.Board
+        """
+        known = self.terminal(board)
+        played = len(board.moves)
+        self.nodes = 0
+        try:
+            if known is None:
+                self.mid(board, INFINITY, INFINITY)
+                known = self.lookup(board)
+        except BudgetExceeded:
+            return None
+        finally:
+            while len(board.moves) > played:
+                board.unmove()
+        phi = known[0]
+        # phi is 0 at a win for the attacker to move or a loss for the defender
+        if board.x_turn == self.x_attacks:
+            return phi == 0
+        return phi != 0
+
+def solve(board, max_nodes = None, max_entries: int = 2 ** 20):
+    """
+    Returns the result of board with perfect play, or None if not proven.
+
+    The result is 1 if X can force a win, -1 if O can, and 0 for a draw.
+    With max_nodes None and a max_entries too small for the proof, the search
+    keeps evicting and redoing work and may not finish in any useful time.
+
+    Parameter board: The board to solve.
+    Precondition: board is a tictactoe.Board
+
+    Parameter max_nodes: The largest number of positions to expand for each
+    of the two proofs, or None for no limit.
+    Precondition: max_nodes is an int > 0 or None
+
+    Parameter max_entries: The largest number of positions kept in memory.
+    Precondition: max_entries is an int and max_entries > 0
+    """
+    # The player to move is tried first, as it wins more often
+    for x_attacks in (board.x_turn, not board.x_turn):
+        proven = ProofSolver(x_attacks, max_entries, max_nodes).prove(board)
+        if proven is None:
+            return None
+        if proven:
+            return 1 if x_attacks else -1
+    return 0
+
+def seed_table(table, board, result: int):
+    """
+    Stores a proven result in a transposition table as a solved position.
+
+    The entry is exact and deep enough that any search reaching the position
+    uses the result instead of searching it.
+
+    Parameter table: The table to store the result in.
+    Precondition: table is a tictactoe.TranspositionTable
+
+    Parameter board: The proven board.
+    Precondition: board is a tictactoe.Board
+
+    Parameter result: The proven result, 1 for X, -1 for O, 0 for a draw.
+    Precondition: result is 1, -1, or 0
+    """
+    key = board.canonical_key()[0] if table.canonical else board.key
+    table.store(key, 255, tictactoe.EXACT, result, None)
+
+def label_dataset(file: str, output: str, max_nodes: int = 100000,
+                  shard_records: int = 10000) -> int:
+    """
+    Relabels a tttdatasets dataset with proven results where possible.
+
+    Each (input, output) pair whose input can be proven within max_nodes gets
+    the proven result as its output. The rest keep their played out result.
+    Returns the number of pairs that were proven.
+
+    Parameter file: The dataset directory or pickle file to relabel.
+    Precondition: file is a str
+
+    Parameter output: The directory to write the relabeled dataset to.
+    Precondition: output is a str naming a new or empty directory
+
+    Parameter max_nodes: The node budget of each proof.
+    Precondition: max_nodes is an int and max_nodes > 0
+
+    Parameter shard_records: The number of records in each output shard.
+    Precondition: shard_records is an int and shard_records > 0
+    """
+    import tttdatasets
+    proven = 0
+    writer = None
+    for input, result in tttdatasets.read_dataset(file):
+        board = tictactoe.board_from_flat(input)
+        if writer is None:
+            writer = tttdatasets.ShardWriter(output, board.width,
+                                             shard_records)
+        value = solve(board, max_nodes)
+        if value is not None:
+            result = value
+            proven += 1
+        writer.write(input, result)
+    if writer is not None:
+        writer.flush()
+    return proven
+
+def main():
+    file = input('Enter name of the dataset: ')
+    output = input('Enter name of the output directory: ')
+    max_nodes = int(input('Enter the node budget per proof: '))
+    import time
+    t1 = time.time()
+    proven = label_dataset(file, output, max_nodes)
+    print(f'Proved {proven} positions in {time.time() - t1:.1f}s.')
+
+if __name__ == '__main__':
+    main()